@@ -0,0 +1,242 @@
+"""
+Benchmarks for renamer.apply_names on synthetic Geotek MSCL exports.
+
+  generate: write an MSCL export and matching core list of a given size
+  run:      time every engine on an export, reporting rows/second, peak memory
+            and whether all engines produced identical output
+
+Examples:
+  $ python3 benchmark.py generate 1m bench_data
+  $ python3 benchmark.py run bench_data/BENCH_1m_MSCL.csv bench_data/BENCH_1m_corelist.csv
+  $ python3 benchmark.py run bench_data/BENCH_1m_MSCL.csv bench_data/BENCH_1m_corelist.csv --save baseline.json
+  $ python3 benchmark.py run bench_data/BENCH_1m_MSCL.csv bench_data/BENCH_1m_corelist.csv --compare baseline.json
+"""
+
+import sys
+import os
+import shutil
+import random
+import hashlib
+import json
+import subprocess
+import tempfile
+import argparse
+
+import renamer
+
+# Data rows for each generated size
+SIZES = {'10k': 10000, '1m': 1000000, '10m': 10000000, '100m': 100000000}
+
+# Modeled on demo_data/PRJ_MSCL.csv: 0.5 cm steps through ~1.5 m sections
+HEADER = ['SB DEPTH', 'SECT NUM', 'SECT DEPTH', 'CT', 'PWAmp', 'PWVel', 'Den1', 'Imp', 'FP', 'RES', 'Temp']
+UNITS = ['m', '', 'cm', 'cm', '', 'm/s', 'g/cc', '', '', 'Ohm.m', '°C']
+STEP = 0.5
+SECTION_LENGTH = 150
+
+
+def generate(rows, output_dir, seed=0):
+  # Write an MSCL export with `rows` data rows and a matching core list. The
+  # export has several file parts whose section numbers restart at 1, a re-scan
+  # of a section (same section number, depth starting over), and sections at
+  # the end of each part that aren't in the core list so they end up unmatched.
+  rng = random.Random(seed)
+  name = f'BENCH_{rows}'
+  for size_name, size_rows in SIZES.items():
+    if size_rows == rows:
+      name = f'BENCH_{size_name}'
+  mscl_filename = os.path.join(output_dir, f'{name}_MSCL.csv')
+  core_list_filename = os.path.join(output_dir, f'{name}_corelist.csv')
+  os.makedirs(output_dir, exist_ok=True)
+
+  rows_per_section = int(SECTION_LENGTH / STEP)
+  total_sections = max(rows // rows_per_section, 1)
+  # Roughly 40 sections to a part, with at least 3 parts
+  sections_per_part = max(min(40, total_sections // 3), 1)
+
+  with open(mscl_filename, 'w', encoding='utf-8-sig', newline='') as f_mscl, open(core_list_filename, 'w', encoding='utf-8', newline='') as f_cores:
+    f_mscl.write(','.join(HEADER) + '\r\n')
+    f_mscl.write(','.join(UNITS) + '\r\n')
+
+    written = 0
+    sb_depth = 0.0
+    part = 0
+    while written < rows:
+      part += 1
+      part_sections = sections_per_part + rng.randint(-2, 2) if sections_per_part > 4 else sections_per_part
+      # Every part keeps at least one section in the core list, or the core
+      # list would lose a file part and every later part would be misnumbered
+      unmatched_tail = min(rng.randint(0, 2), part_sections - 1)
+      for section in range(1, part_sections + 1):
+        in_core_list = section <= part_sections - unmatched_tail
+        # A re-scan starts a new file part, so the core list repeats the section.
+        # Only sections in the core list are re-scanned, for the same reason.
+        scans = 2 if in_core_list and rng.random() < 0.02 else 1
+        for _ in range(scans):
+          if in_core_list:
+            f_cores.write(f'{section},BENCH-GEN{part:04d}-1A-{section}H-1\n')
+          lines = []
+          for step in range(rows_per_section):
+            if written >= rows:
+              break
+            sb_depth += STEP / 100
+            lines.append(f'{sb_depth:.3f},{section},{step * STEP:g},{10.7 + rng.random() / 10:.3f},0,'
+                         f'{rng.uniform(1400, 2200):.3f},{rng.uniform(0.8, 1.6):.4f},{rng.uniform(1500, 3500):.3f},'
+                         f'{rng.uniform(0.5, 1.1):.4f},0,{rng.uniform(22, 24):.2f}\r\n')
+            written += 1
+          f_mscl.writelines(lines)
+        if written >= rows:
+          break
+
+  return mscl_filename, core_list_filename
+
+
+def _file_digest(filename):
+  if not os.path.isfile(filename):
+    return None
+  digest = hashlib.sha256()
+  with open(filename, 'rb') as f:
+    for block in iter(lambda: f.read(1 << 20), b''):
+      digest.update(block)
+  return digest.hexdigest()
+
+
+def _run_one(input_file, core_list_filename, engine):
+  # Run by `run` in a fresh interpreter so peak memory belongs to this engine only
+  with open(os.devnull, 'w') as devnull:
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+      start_time = renamer.timeit.default_timer()
+      report = renamer.apply_names(input_file, core_list_filename, engine=engine, use_cache=False)
+      elapsed = renamer.timeit.default_timer() - start_time
+    finally:
+      sys.stdout = stdout
+  print(json.dumps({'elapsed': elapsed,
+                    'peak_rss': renamer.peak_memory(),
+                    'matched_filename': report.matched_filename,
+                    'unmatched_filename': report.unmatched_filename,
+                    'rows': report.matched_count + report.unmatched_count}))
+
+
+def run(input_file, core_list_filename, engines, repeat=1):
+  # Return the results for each engine that finished, and the engines whose
+  # run crashed (with the error output), which `report` counts as failures.
+  results = {}
+  crashed = {}
+  bytes_in = os.path.getsize(input_file)
+  work_dir = tempfile.mkdtemp(prefix='renamer_bench_')
+  try:
+    for engine in engines:
+      # Each engine writes its outputs next to its own link to the input
+      engine_dir = os.path.join(work_dir, engine)
+      os.makedirs(engine_dir)
+      engine_input = os.path.join(engine_dir, os.path.basename(input_file))
+      try:
+        os.symlink(os.path.abspath(input_file), engine_input)
+      except (OSError, NotImplementedError):
+        shutil.copyfile(input_file, engine_input)
+
+      runs = []
+      for _ in range(repeat):
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '_run_one', engine_input, core_list_filename, engine],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+          crashed[engine] = f'{proc.stdout}{proc.stderr}'.strip()
+          break
+        runs.append(json.loads(proc.stdout.splitlines()[-1]))
+      if engine in crashed:
+        continue
+
+      best = min(runs, key=lambda r: r['elapsed'])
+      results[engine] = {'rows': best['rows'],
+                         'seconds': best['elapsed'],
+                         'rows_per_second': best['rows'] / best['elapsed'] if best['elapsed'] else None,
+                         'mb_per_second': bytes_in / best['elapsed'] / 1e6 if best['elapsed'] else None,
+                         'peak_rss': max(r['peak_rss'] or 0 for r in runs) or None,
+                         'matched_digest': _file_digest(best['matched_filename']),
+                         'unmatched_digest': _file_digest(best['unmatched_filename'])}
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+  reference = next(iter(results.values()), None)
+  for result in results.values():
+    result['identical'] = (result['matched_digest'], result['unmatched_digest']) == (reference['matched_digest'], reference['unmatched_digest'])
+  return results, crashed
+
+
+def report(results, crashed=None, baseline=None, tolerance=0.2):
+  # Print one line per engine; return the engines that crashed, are slower than
+  # the baseline by more than tolerance, are in the baseline but weren't run,
+  # or whose output differs from the first engine.
+  failures = []
+  for engine, error in (crashed or {}).items():
+    print(f'ERROR: {engine} engine failed:\n{error}')
+    failures.append(engine)
+  print(f"{'engine':<10}{'rows':>12}{'seconds':>10}{'rows/s':>14}{'MB/s':>8}{'peak RSS MB':>13}  output")
+  for engine, result in results.items():
+    peak = f"{result['peak_rss'] / 1e6:.1f}" if result['peak_rss'] else 'n/a'
+    print(f"{engine:<10}{result['rows']:>12}{result['seconds']:>10.2f}{result['rows_per_second']:>14.0f}{result['mb_per_second']:>8.1f}{peak:>13}  {'identical' if result['identical'] else 'DIFFERS'}")
+    if not result['identical']:
+      failures.append(engine)
+    if baseline and engine in baseline and baseline[engine]['rows_per_second']:
+      change = result['rows_per_second'] / baseline[engine]['rows_per_second'] - 1
+      print(f"{'':<10}{change:+.1%} rows/s compared to baseline")
+      if change < -tolerance:
+        print(f'REGRESSION: {engine} engine is more than {tolerance:.0%} slower than the baseline.')
+        failures.append(engine)
+  for engine in baseline or {}:
+    if engine not in results and engine not in (crashed or {}):
+      print(f'MISSING: {engine} engine is in the baseline but has no results to compare.')
+      failures.append(engine)
+  return failures
+
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmark renamer.apply_names on synthetic Geotek MSCL exports.')
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  gen_parser = subparsers.add_parser('generate', help='Write a synthetic MSCL export and core list.')
+  gen_parser.add_argument('size', type=str, help=f"Number of data rows, or one of {', '.join(SIZES)}.")
+  gen_parser.add_argument('output_dir', type=str, help='Directory to write the files to.')
+  gen_parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+  run_parser = subparsers.add_parser('run', help='Time each engine on an MSCL export.')
+  run_parser.add_argument('input_file', type=str, help='MSCL export to process.')
+  run_parser.add_argument('corelist', type=str, help='Core list file.')
+  run_parser.add_argument('-e', '--engines', nargs='+', choices=renamer.ENGINES, help='Engines to run (default: all available).')
+  run_parser.add_argument('-r', '--repeat', type=int, default=1, help='Runs per engine; the fastest is reported.')
+  run_parser.add_argument('--save', type=str, help='Write the results to this JSON file.')
+  run_parser.add_argument('--compare', type=str, help='JSON results from an earlier --save to check for regressions.')
+  run_parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against --compare before failing (default 0.2 = 20%%).')
+
+  one_parser = subparsers.add_parser('_run_one')
+  one_parser.add_argument('input_file')
+  one_parser.add_argument('corelist')
+  one_parser.add_argument('engine')
+
+  args = parser.parse_args()
+
+  if args.command == 'generate':
+    rows = SIZES[args.size.lower()] if args.size.lower() in SIZES else int(args.size)
+    mscl_filename, core_list_filename = generate(rows, args.output_dir, seed=args.seed)
+    print(f'Wrote {rows} rows to {mscl_filename} and core list {core_list_filename}.')
+
+  elif args.command == '_run_one':
+    _run_one(args.input_file, args.corelist, args.engine)
+
+  elif args.command == 'run':
+    engines = args.engines or [e for e in renamer.ENGINES if e != 'numpy' or renamer.np is not None]
+    results, crashed = run(args.input_file, args.corelist, engines, repeat=args.repeat)
+    baseline = None
+    if args.compare:
+      with open(args.compare, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    failures = report(results, crashed, baseline, args.tolerance)
+    if args.save:
+      with open(args.save, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    if failures:
+      exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,237 @@
+"""
+Typed columnar binary files for apply_names output, and a loader for them.
+
+Rows are written in row groups as they arrive, one block per column per group:
+  float64: little-endian doubles, for columns whose values in the group all parse
+           as numbers (empty values are stored as NaN)
+  dict:    int32 codes into a JSON list of the group's distinct values, for
+           everything else (core IDs, Part_Section, text columns)
+
+The column names, units row, row groups and block offsets are kept in a JSON
+footer, so loading a column is a seek and a copy instead of parsing CSV text.
+
+  b'CSDCOCOL' | blocks... | footer JSON | footer length (uint64 LE) | b'CSDCOCOL'
+
+Example:
+  >>> import columnar
+  >>> data = columnar.load('PRJ_MSCL_coreID.col')
+  >>> data['SECT DEPTH'], data.units['SECT DEPTH'], data['SECT NUM'].values
+"""
+
+import sys
+import os
+import math
+import json
+import mmap
+import struct
+from array import array
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+MAGIC = b'CSDCOCOL'
+FORMAT_VERSION = 1
+EXTENSION = '.col'
+
+
+class ColumnarError(Exception):
+  pass
+
+
+def _float_block(values):
+  # Doubles for a column of numbers, or None if any value isn't one. float()
+  # reads '1_5' as 15, so Part_Section values have to be caught first.
+  if any('_' in v for v in values):
+    return None
+  try:
+    block = array('d', [float(v) if v else math.nan for v in values])
+  except ValueError:
+    return None
+  if sys.byteorder == 'big':
+    block.byteswap()
+  return block.tobytes()
+
+
+def _dict_block(values):
+  codes = {}
+  block = array('i', [codes.setdefault(v, len(codes)) for v in values])
+  if sys.byteorder == 'big':
+    block.byteswap()
+  return block.tobytes(), json.dumps(list(codes), ensure_ascii=False).encode('utf-8')
+
+
+class ColumnarWriter:
+  # Write rows (lists of strings, as the csv module would) to a columnar file.
+  # Rows are padded or cut to the width of the header. The footer is written by
+  # close(), so a file that wasn't closed can't be loaded.
+  def __init__(self, filename, header, units, metadata=None):
+    self.filename = filename
+    self.names = list(header)
+    self.units = list(units) + [''] * (len(header) - len(units))
+    self.metadata = metadata or {}
+    self.row_groups = []
+    self.f = open(filename, 'wb')
+    self.f.write(MAGIC)
+
+  def _write_block(self, data):
+    offset = self.f.tell()
+    self.f.write(data)
+    return offset, len(data)
+
+  def writerows(self, rows):
+    width = len(self.names)
+    rows = [r if len(r) == width else (list(r) + [''] * width)[:width] for r in rows]
+    if not rows:
+      return
+    columns = []
+    for values in zip(*rows):
+      data = _float_block(values)
+      if data is not None:
+        offset, length = self._write_block(data)
+        columns.append({'type': 'float64', 'offset': offset, 'length': length})
+      else:
+        codes, dictionary = _dict_block(values)
+        offset, length = self._write_block(codes)
+        dict_offset, dict_length = self._write_block(dictionary)
+        columns.append({'type': 'dict', 'offset': offset, 'length': length, 'dict_offset': dict_offset, 'dict_length': dict_length})
+    self.row_groups.append({'rows': len(rows), 'columns': columns})
+
+  def close(self):
+    if self.f.closed:
+      return
+    footer = json.dumps({'version': FORMAT_VERSION,
+                         'names': self.names,
+                         'units': self.units,
+                         'metadata': self.metadata,
+                         'row_groups': self.row_groups}, ensure_ascii=False).encode('utf-8')
+    self.f.write(footer)
+    self.f.write(struct.pack('<Q', len(footer)))
+    self.f.write(MAGIC)
+    self.f.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.close()
+
+
+class DictionaryColumn:
+  # A dictionary-encoded column: row i holds values[codes[i]]. codes is a numpy
+  # int32 array if numpy is installed, otherwise an array('i').
+  def __init__(self, codes, values):
+    self.codes = codes
+    self.values = values
+
+  def __len__(self):
+    return len(self.codes)
+
+  def __getitem__(self, i):
+    return self.values[self.codes[i]]
+
+  def __iter__(self):
+    return (self.values[code] for code in self.codes)
+
+  def to_list(self):
+    return [self.values[code] for code in self.codes]
+
+
+class ColumnarData:
+  # Columns loaded from a columnar file, looked up by name. Number columns are
+  # numpy float64 arrays if numpy is installed, otherwise array('d'); other
+  # columns are DictionaryColumns.
+  def __init__(self, names, units, columns, metadata):
+    self.names = names
+    self.units = dict(zip(names, units))
+    self.columns = columns
+    self.metadata = metadata
+
+  def __len__(self):
+    return len(self.columns[0]) if self.columns else 0
+
+  def __getitem__(self, name):
+    return self.columns[self.names.index(name)]
+
+  def __contains__(self, name):
+    return name in self.names
+
+
+def _float_column(mm, blocks):
+  if np is not None:
+    return np.concatenate([np.frombuffer(mm, dtype='<f8', count=b['length'] // 8, offset=b['offset']) for b in blocks]) if blocks else np.empty(0)
+  column = array('d')
+  for b in blocks:
+    column.frombytes(mm[b['offset']:b['offset'] + b['length']])
+  if sys.byteorder == 'big':
+    column.byteswap()
+  return column
+
+
+def _dict_block_codes(mm, b):
+  values = json.loads(mm[b['dict_offset']:b['dict_offset'] + b['dict_length']].decode('utf-8'))
+  if np is not None:
+    return values, np.frombuffer(mm, dtype='<i4', count=b['length'] // 4, offset=b['offset'])
+  codes = array('i')
+  codes.frombytes(mm[b['offset']:b['offset'] + b['length']])
+  if sys.byteorder == 'big':
+    codes.byteswap()
+  return values, codes
+
+
+def _float_block_codes(mm, b):
+  # A float64 block as text, for columns that are numbers in only some row groups
+  numbers = _float_column(mm, [b])
+  return _dict_block_codes_from_text(['' if math.isnan(v) else repr(float(v)) for v in numbers])
+
+
+def _dict_block_codes_from_text(text):
+  positions = {}
+  codes = [positions.setdefault(v, len(positions)) for v in text]
+  return list(positions), np.array(codes, dtype=np.int32) if np is not None else array('i', codes)
+
+
+def _dict_column(mm, blocks):
+  # Merge each row group's dictionary into one, remapping the group's codes
+  positions = {}
+  parts = []
+  for b in blocks:
+    group_values, codes = _dict_block_codes(mm, b) if b['type'] == 'dict' else _float_block_codes(mm, b)
+    remap = [positions.setdefault(v, len(positions)) for v in group_values]
+    if np is not None:
+      parts.append(np.array(remap, dtype=np.int32)[codes] if remap else np.empty(0, dtype=np.int32))
+    else:
+      parts.append(array('i', [remap[code] for code in codes]))
+  if np is not None:
+    codes = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+  else:
+    codes = array('i')
+    for part in parts:
+      codes.extend(part)
+  return DictionaryColumn(codes, list(positions))
+
+
+def load(filename):
+  # Load every column of a columnar file written by ColumnarWriter
+  with open(filename, 'rb') as f:
+    if os.fstat(f.fileno()).st_size < 2 * len(MAGIC) + 8:
+      raise ColumnarError(f'{filename} is not a columnar file.')
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+      if mm[:len(MAGIC)] != MAGIC or mm[-len(MAGIC):] != MAGIC:
+        raise ColumnarError(f'{filename} is not a columnar file, or it was not completely written.')
+      footer_length, = struct.unpack('<Q', mm[-len(MAGIC) - 8:-len(MAGIC)])
+      footer_end = len(mm) - len(MAGIC) - 8
+      footer = json.loads(mm[footer_end - footer_length:footer_end].decode('utf-8'))
+      if footer['version'] > FORMAT_VERSION:
+        raise ColumnarError(f"{filename} is version {footer['version']} of the columnar format, this loader reads up to version {FORMAT_VERSION}.")
+
+      columns = []
+      for i in range(len(footer['names'])):
+        blocks = [group['columns'][i] for group in footer['row_groups']]
+        if blocks and all(b['type'] == 'float64' for b in blocks):
+          columns.append(_float_column(mm, blocks))
+        else:
+          # Numbers in only some row groups are loaded as text (repr of the float)
+          columns.append(_dict_column(mm, blocks))
+  return ColumnarData(footer['names'], footer['units'], columns, footer['metadata'])
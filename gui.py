@@ -1,3 +1,5 @@
+import multiprocessing
+
 from gooey import Gooey, GooeyParser
 import renamer
 
@@ -10,16 +12,59 @@ def main():
   parser.add_argument('-v', '--verbose', metavar='Verbose', action='store_true', help='Print troubleshooting information.')
   parser.add_argument('-s', '--section_column', type=int, metavar='Section Number Column', help='Column number the section numbers are in (count starts at 0).')
   parser.add_argument('-d', '--depth_column', type=int, metavar='Section Depth Column', help='Column number the section depths are in (count starts at 0).')
+  parser.add_argument('--header_row', type=int, metavar='Header Row', help='Row the column names are in (count starts at 0, default 0).')
+  parser.add_argument('--units_row', type=int, metavar='Units Row', help='Row the units are in (count starts at 0, default 1).')
+  parser.add_argument('--start_row', type=int, metavar='Start Row', help='First row of data (count starts at 0, default 2).')
+  parser.add_argument('-e', '--engine', widget='Dropdown', choices=renamer.ENGINES, default='python', metavar='Engine', help='Part_Section engine to use (numpy is fastest on large files).')
+  parser.add_argument('-z', '--compress', dest='compression', widget='Dropdown', choices=renamer.COMPRESSIONS + ['none'], metavar='Compression', help='Compress the outputs (default: same as the input file).')
+  parser.add_argument('--compress-level', type=int, metavar='Compression Level', help='0-9 (1-9 for bz2; default 6, or 9 for bz2).')
+  parser.add_argument('--check', metavar='Check Only', action='store_true', help='Only check the input against the core list, without writing any files.')
+  parser.add_argument('--max-unmatched', type=int, metavar='Max Unmatched Rows', help='When checking, stop once more than this many rows are unmatched.')
+  parser.add_argument('--sort-by', action='append', metavar='Sort By', help='Sort the rows by this column (name or number) before assigning parts, for merged or out of order exports.')
+  parser.add_argument('-p', '--pipeline', metavar='Background Writes', action='store_true', help='Write the outputs on background threads (faster on slow disks and network shares).')
+  parser.add_argument('-j', '--jobs', type=int, metavar='Jobs', help='Split the input file across this many worker processes (uncompressed files only).')
+  parser.add_argument('-f', '--format', dest='output_format', widget='Dropdown', choices=renamer.OUTPUT_FORMATS, default='csv', metavar='Output Format', help='Write the matched rows as CSV, a typed columnar .col file, or both.')
+  parser.add_argument('--columnar-unmatched', metavar='Columnar Unmatched', action='store_true', help='Write the unmatched rows as a columnar .col file too.')
 
   args = parser.parse_args()
 
-  renamer.apply_names(args.input_file,
-                      args.corelist,
-                      section_column=args.section_column,
-                      depth_column=args.depth_column,
-                      output_filename=args.output_filename,
-                      verbose=args.verbose)
+  try:
+    if args.check:
+      if args.sort_by:
+        parser.error('Check Only cannot be used with Sort By.')
+      renamer.check_export(args.input_file,
+                           args.corelist,
+                           max_unmatched=args.max_unmatched,
+                           section_column=args.section_column,
+                           depth_column=args.depth_column,
+                           header_row=args.header_row,
+                           units_row=args.units_row,
+                           start_row=args.start_row,
+                           verbose=args.verbose)
+      return
+    renamer.apply_names(args.input_file,
+                        args.corelist,
+                        section_column=args.section_column,
+                        depth_column=args.depth_column,
+                        header_row=args.header_row,
+                        units_row=args.units_row,
+                        start_row=args.start_row,
+                        output_filename=args.output_filename,
+                        engine=args.engine,
+                        compression=args.compression,
+                        compress_level=args.compress_level,
+                        jobs=args.jobs,
+                        pipeline=args.pipeline,
+                        sort_by=args.sort_by,
+                        output_format=args.output_format,
+                        columnar_unmatched=args.columnar_unmatched,
+                        verbose=args.verbose)
+  except renamer.AssignerError as err:
+    print(f'ERROR: {err}')
+    exit(1)
 
 
 if __name__ == '__main__':
+  # -j runs worker processes, which a frozen app has to be able to start
+  multiprocessing.freeze_support()
   main()
@@ -9,11 +9,73 @@ Heavily borrowed from Brian Grivna's work on the rgbaggregator at https://github
 
 import os
 import sys
+import threading
+import contextlib
+import timeit
 
-from PyQt5 import QtWidgets
+from PyQt5 import QtWidgets, QtCore, QtGui
 
 import renamer
 
+class RenameWorker(QtCore.QThread):
+    # Runs renamer.apply_names off the GUI thread. Everything apply_names prints
+    # is sent to the log a line at a time; progress is reported after each batch.
+    progress = QtCore.pyqtSignal(object, object, object, float) # rows, bytes read, total bytes, ETA seconds (-1 if unknown)
+    log = QtCore.pyqtSignal(str)
+    finishedRun = QtCore.pyqtSignal(object) # RunReport
+    cancelledRun = QtCore.pyqtSignal()
+    failedRun = QtCore.pyqtSignal(str)
+
+    def __init__(self, inFile, coreListFile, **kwargs):
+        QtCore.QThread.__init__(self)
+        self.inFile = inFile
+        self.coreListFile = coreListFile
+        self.kwargs = kwargs
+        self.cancelEvent = threading.Event()
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def run(self):
+        self.startTime = timeit.default_timer()
+        logStream = LogStream(self.log)
+        try:
+            with contextlib.redirect_stdout(logStream):
+                try:
+                    report = renamer.apply_names(self.inFile, self.coreListFile, progress=self.onProgress, cancel=self.cancelEvent, **self.kwargs)
+                finally:
+                    # Send the last line even if it doesn't end with a newline
+                    logStream.flush()
+        except renamer.RunCancelled:
+            self.cancelledRun.emit()
+        except Exception as err:
+            self.failedRun.emit(str(err))
+        else:
+            self.finishedRun.emit(report)
+
+    def onProgress(self, rows, bytesRead, totalBytes):
+        elapsed = timeit.default_timer() - self.startTime
+        eta = elapsed * (totalBytes - bytesRead) / bytesRead if bytesRead else -1.0
+        self.progress.emit(rows, bytesRead, totalBytes, eta)
+
+class LogStream:
+    # File-like object that emits each complete line written to it
+    def __init__(self, signal):
+        self.signal = signal
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            self.signal.emit(line)
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.signal.emit(self.buffer)
+            self.buffer = ''
+
 class RenamerWindow(QtWidgets.QWidget):
     def __init__(self, app):
         self.app = app
@@ -89,15 +151,31 @@ class RenamerWindow(QtWidgets.QWidget):
         self.logArea.setReadOnly(True)
         self.logArea.setToolTip("Renaming log.")
         vlayout.addWidget(self.logArea)
-        
+
+        # progress
+        self.progressBar = QtWidgets.QProgressBar(self)
+        self.progressBar.setRange(0, 1000)
+        self.progressBar.setValue(0)
+        vlayout.addWidget(self.progressBar)
+        self.progressLabel = QtWidgets.QLabel("", self)
+        vlayout.addWidget(self.progressLabel)
+
+        buttonLayout = QtWidgets.QHBoxLayout()
         self.renameButton = QtWidgets.QPushButton("Apply CoreIDs")
         self.renameButton.clicked.connect(self.rename)
-        vlayout.addWidget(self.renameButton, stretch=1)
+        buttonLayout.addWidget(self.renameButton, stretch=1)
+        self.cancelButton = QtWidgets.QPushButton("Cancel")
+        self.cancelButton.clicked.connect(self.cancel)
+        self.cancelButton.setEnabled(False)
+        buttonLayout.addWidget(self.cancelButton)
+        vlayout.addLayout(buttonLayout)
+
+        self.worker = None
 
     def rename(self):
         inFile = self.inputPathText.text()
         if not os.path.isfile(inFile):
-            self._warnbox("Badness", "Input file {0} does not exist".format(inputPathText))
+            self._warnbox("Badness", "Input file {0} does not exist".format(inFile))
             return
 
         coreListFile = self.coreListPathText.text()
@@ -107,12 +185,13 @@ class RenamerWindow(QtWidgets.QWidget):
 
         outFile = self.outputPathText.text()
         if not os.path.exists(os.path.dirname(outFile)):
-            self._warnbox("Badness", "Output file {0} does not exist".format(outputPathText))
+            self._warnbox("Badness", "Output file {0} does not exist".format(outFile))
             return
         
-        unmatchedFile = '.'.join(outFile.split('.')[:-1]) + '_UNMATCHED.csv'
+        outName, compressionExtension = renamer.split_compression_extension(outFile)
+        unmatchedFile = '.'.join(outName.split('.')[:-1]) + '_UNMATCHED.csv' + compressionExtension
         if not os.path.exists(os.path.dirname(unmatchedFile)):
-            self._warnbox("Badness", "Output file {0} does not exist".format(outputPathText))
+            self._warnbox("Badness", "Output file {0} does not exist".format(unmatchedFile))
             return
 
         headerRow = None
@@ -155,18 +234,61 @@ class RenamerWindow(QtWidgets.QWidget):
                 # return
 
         self.renameButton.setEnabled(False)
+        self.cancelButton.setEnabled(True)
+        self.progressBar.setValue(0)
+        self.progressLabel.setText("")
         # self.logArea.clear()
-        try:
-            renamer.apply_names(inFile, coreListFile, outputfilename=outFile, unmatchedfilename=unmatchedFile, headerrow=headerRow, unitrow=unitRow, startrow=startRow)
-        except Exception as err:
-            self.report("\nSUPER FATAL ERROR: " + str(err))
-            print('infile: {}\ncoreListFile: {}\noutputfilename: {}\nunmatchedfilename: {}\nheaderrow: {}\nunitrow: {}\nstartrow: {}'.format(inFile, coreListFile, outFile, unmatchedFile, headerRow, unitRow, startRow))            
+        self.worker = RenameWorker(inFile, coreListFile, output_filename=outFile, unmatched_filename=unmatchedFile, header_row=headerRow, units_row=unitRow, start_row=startRow)
+        self.worker.log.connect(self.report)
+        self.worker.progress.connect(self.updateProgress)
+        self.worker.finishedRun.connect(self.renameFinished)
+        self.worker.cancelledRun.connect(self.renameCancelled)
+        self.worker.failedRun.connect(self.renameFailed)
+        self.worker.finished.connect(self.workerDone)
+        self.worker.start()
+
+    def cancel(self):
+        if self.worker is not None:
+            self.cancelButton.setEnabled(False)
+            self.progressLabel.setText("Cancelling...")
+            self.worker.cancel()
+
+    def closeEvent(self, event):
+        # Don't let the window (and the worker thread with it) go away mid-run
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker.wait()
+        event.accept()
+
+    def updateProgress(self, rows, bytesRead, totalBytes, eta):
+        if totalBytes:
+            self.progressBar.setValue(int(1000 * bytesRead / totalBytes))
+        etaText = "{0}:{1:02d}".format(int(eta // 60), int(eta % 60)) if eta >= 0 else "unknown"
+        self.progressLabel.setText("{0:,} rows, {1:.1f} of {2:.1f} MB read, {3} remaining".format(rows, bytesRead / 1e6, totalBytes / 1e6, etaText))
+
+    def renameFinished(self, report):
+        self.progressBar.setValue(1000)
+        self.progressLabel.setText("Finished in {0:.1f} seconds.".format(report.elapsed))
+
+    def renameCancelled(self):
+        self.progressBar.setValue(0)
+        self.progressLabel.setText("Cancelled.")
+        self.report("Cancelled, partial output files were removed.")
+
+    def renameFailed(self, message):
+        self.progressLabel.setText("Failed.")
+        self.report("\nSUPER FATAL ERROR: " + message)
+        print('infile: {}\ncoreListFile: {}\nkwargs: {}'.format(self.worker.inFile, self.worker.coreListFile, self.worker.kwargs))
+
+    def workerDone(self):
         self.renameButton.setEnabled(True)
+        self.cancelButton.setEnabled(False)
+        self.worker = None
         
     def report(self, text, newline=True):
         text += '\n' if newline else ''
+        self.logArea.moveCursor(QtGui.QTextCursor.End)
         self.logArea.insertPlainText(text)
-        self.app.processEvents() # force GUI update
         
     def _warnbox(self, title, message):
         QtWidgets.QMessageBox.warning(self, title, message)
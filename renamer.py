@@ -17,194 +17,2144 @@ import os.path
 import timeit
 import argparse
 import csv
+import itertools
+import collections
+import glob
+import io
+import contextlib
+import hashlib
+import pickle
+import json
+import platform
+import cProfile
+import mmap
+import gzip
+import bz2
+import lzma
+import time
+import fnmatch
+import datetime
+import queue
+import threading
+import heapq
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import columnar
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 version = '1.0.0'
 
+# Part_Section engines apply_names can use
+ENGINES = ['python', 'numpy', 'mmap']
 
-def apply_names(input_file, core_list_filename, **kwargs):
-  verbose = kwargs['verbose'] if 'verbose' in kwargs else False
+# Number of data rows matched and written at a time
+CHUNK_SIZE = 100000
+# The numpy engine reads and matches the input in blocks of this many bytes.
+# Depths it parses itself use only these characters; others go through float().
+NUMPY_BLOCK_SIZE = 1024 * 1024
+NUMPY_DEPTH_BYTES = b'0123456789.+-eE\x00'
 
-  if verbose:
-    start_time = timeit.default_timer()
+# Compiled core lists are cached on disk, keyed by a hash of the core list file,
+# so the CLI and both GUIs can skip parsing a core list they've seen before.
+CORE_LIST_CACHE_VERSION = 2
+CORE_LIST_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Phases timed when apply_names is profiled, in the order they happen
+PROFILE_PHASES = ['read', 'columns', 'core_list', 'sort', 'assign', 'match', 'matched_write', 'unmatched_write', 'checkpoint', 'report']
+
+# Sorted runs sort this many rows at a time in memory, spilling each sorted
+# run to a temporary file, then merge up to SORT_MERGE_WIDTH runs at once.
+# Runs are read back in blocks of run rows / SORT_MERGE_WIDTH (but at least
+# SORT_MIN_BLOCK_ROWS), so a merge holds about as many rows as one run.
+SORT_RUN_ROWS = 500000
+SORT_MERGE_WIDTH = 64
+SORT_MIN_BLOCK_ROWS = 100
+
+# Pipelined runs hand batches to writer threads through queues of this many
+# batches, and give uncompressed outputs buffers of this size
+WRITE_QUEUE_SIZE = 4
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Parallel runs split the input into byte ranges of about this size (or one per
+# worker, if that gives more)
+PARALLEL_CHUNK_BYTES = 32 * 1024 * 1024
+
+# Incremental runs keep their progress in a sidecar next to the matched output
+CHECKPOINT_VERSION = 1
+
+# Formats apply_names can write the matched rows in
+OUTPUT_FORMATS = ['csv', 'columnar', 'both']
+
+# Compressed inputs, core lists and outputs are read and written as streams
+COMPRESSIONS = ['gz', 'bz2', 'xz']
+COMPRESSION_EXTENSIONS = {'.gz': 'gz', '.bz2': 'bz2', '.xz': 'xz'}
+COMPRESSION_MAGIC = {b'\x1f\x8b': 'gz', b'BZh': 'bz2', b'\xfd7zXZ\x00': 'xz'}
+# Same defaults as the gzip, bzip2 and xz command line tools
+COMPRESSION_DEFAULT_LEVELS = {'gz': 6, 'bz2': 9, 'xz': 6}
+
+# Watch mode: which files are exports, how often folders are polled, how long a
+# file must stay unchanged before it counts as finished, and where runs are logged
+WATCH_PATTERNS = ['*MSCL*.csv', '*MSCL*.csv.gz', '*MSCL*.csv.bz2', '*MSCL*.csv.xz']
+WATCH_INTERVAL = 2.0
+WATCH_SETTLE = 5.0
+RUN_LOG_NAME = 'coreid_runs.jsonl'
+
+
+def split_compression_extension(filename):
+  # 'X_MSCL.csv.gz' -> ('X_MSCL.csv', '.gz'); ('X_MSCL.csv', '') if not compressed
+  root, ext = os.path.splitext(filename)
+  if ext.lower() in COMPRESSION_EXTENSIONS:
+    return root, ext
+  return filename, ''
+
+
+def detect_compression(filename):
+  # Compression of an existing file from its extension, or else its first bytes
+  _, ext = split_compression_extension(filename)
+  if ext:
+    return COMPRESSION_EXTENSIONS[ext.lower()]
+  with open(filename, 'rb') as f:
+    start = f.read(6)
+  for magic, compression in COMPRESSION_MAGIC.items():
+    if start.startswith(magic):
+      return compression
+  return None
+
+
+def open_compressed(file, mode, compression=None, level=None, **kwargs):
+  # open() for plain, gzip, bz2 or xz files. file can be a filename or a binary
+  # file object (which is left open); text modes take open()'s encoding and newline.
+  if compression is None:
+    return open(file, mode, **kwargs)
+  if 'r' not in mode:
+    level = COMPRESSION_DEFAULT_LEVELS[compression] if level is None else level
+    if compression == 'xz':
+      return lzma.open(file, mode, preset=level, **kwargs)
+    return {'gz': gzip.open, 'bz2': bz2.open}[compression](file, mode, compresslevel=level, **kwargs)
+  return {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}[compression](file, mode, **kwargs)
+
+
+def parse_core_list(core_list_filename):
+  # Build the section list
+  with open_compressed(core_list_filename, 'rt', detect_compression(core_list_filename), encoding='utf-8-sig') as f:
+    rows = f.read().splitlines()
+  try:
+    section_list = [[int(core_num), core_name] for core_num, core_name in [r.split(',') for r in rows]]
+  except ValueError as err:
+    raise CoreListError(f'Could not read core list {core_list_filename} (expected rows of section number,coreID): {err}') from err
+
+  # Add the filepart_section notation field to the section log
+  num_sections = 1
+  for i, row in enumerate(section_list):
+    if i == 0:
+      row.append('1_' + str(section_list[i][0]))
+    elif i > 0:
+      if section_list[i][0] <= section_list[i-1][0]:
+        num_sections += 1
+      row.append(str(num_sections) + '_' + str(section_list[i][0]))
+
+  # Build a dictionary for lookup from the list
+  return {section[2]: section[1] for section in section_list}
+
+
+def core_list_cache_dir():
+  if 'CSDCO_CACHE_DIR' in os.environ:
+    return os.environ['CSDCO_CACHE_DIR']
+  if sys.platform == 'win32' and 'LOCALAPPDATA' in os.environ:
+    return os.path.join(os.environ['LOCALAPPDATA'], 'csdco-coreid-assigner')
+  return os.path.join(os.path.expanduser('~'), '.cache', 'csdco-coreid-assigner')
+
+
+def _evict_core_list_cache(cache_dir, max_bytes):
+  # Remove the least recently used entries until the cache fits in max_bytes
+  entries = []
+  for name in os.listdir(cache_dir):
+    if name.startswith('corelist-') and name.endswith('.json'):
+      stat = os.stat(os.path.join(cache_dir, name))
+      entries.append((stat.st_mtime, stat.st_size, name))
+  total = sum(size for _, size, _ in entries)
+  for _, size, name in sorted(entries):
+    if total <= max_bytes:
+      break
+    os.remove(os.path.join(cache_dir, name))
+    total -= size
+
+
+def read_core_list(core_list_filename, use_cache=True, verbose=False):
+  # Return the part_section -> coreID dictionary for a core list, from the cache
+  # if this exact file content has been compiled before.
+  if not use_cache:
+    return parse_core_list(core_list_filename)
+
+  with open(core_list_filename, 'rb') as f:
+    digest = hashlib.sha256(f.read()).hexdigest()
+  cache_dir = core_list_cache_dir()
+  cache_filename = os.path.join(cache_dir, f'corelist-v{CORE_LIST_CACHE_VERSION}-{digest}.json')
+
+  # The cache is only an optimization: any problem reading or writing it falls
+  # back to parsing the core list. It's plain JSON, and anything in it other than
+  # a dictionary of strings is ignored, as the cache directory can be shared.
+  try:
+    with open(cache_filename, 'r', encoding='utf-8') as f:
+      sectionDict = json.load(f)
+    if isinstance(sectionDict, dict) and all(isinstance(k, str) and isinstance(v, str) for k, v in sectionDict.items()):
+      os.utime(cache_filename)
+      if verbose:
+        print(f'Using cached core list for {core_list_filename} ({cache_filename})')
+      return sectionDict
+  except (OSError, ValueError):
+    pass
+
+  sectionDict = parse_core_list(core_list_filename)
+
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_filename = f'{cache_filename}.{os.getpid()}.tmp'
+    with open(temp_filename, 'w', encoding='utf-8') as f:
+      json.dump(sectionDict, f)
+    os.replace(temp_filename, cache_filename)
+    _evict_core_list_cache(cache_dir, CORE_LIST_CACHE_MAX_BYTES)
+  except OSError as err:
+    if verbose:
+      print(f'Could not write core list cache {cache_filename}: {err}')
+
+  return sectionDict
+
+
+def new_part_state():
+  # Part numbering state carried between chunks, workers and incremental runs.
+  # The previous section and depth are kept as the text from the file.
+  return {'num_sections': 1, 'prev_section': None, 'prev_depth': None}
+
+
+def assign_parts(rows, section_column, section_depth_column, state=None):
+  # Yield (part, row) for each data row, part being the file part number. A new
+  # file part starts when the section number goes down, or stays the same while
+  # the section depth goes down. Only the previous row is kept, so memory use
+  # doesn't grow with the input. If a state dict is passed, numbering continues
+  # from it and it is updated once all rows have been consumed.
+  if state is None:
+    state = new_part_state()
+  num_sections = state['num_sections']
+  prev_section = state['prev_section']
+  prev_depth = state['prev_depth']
+  prev_number = int(prev_section) if prev_section is not None else None
+  try:
+    for row in rows:
+      section = row[section_column]
+      depth = row[section_depth_column]
+      number = int(section)
+      if prev_number is not None:
+        if number < prev_number:
+          num_sections += 1
+        elif number == prev_number and float(depth) < float(prev_depth):
+          num_sections += 1
+      yield num_sections, row
+      prev_section = section
+      prev_number = number
+      prev_depth = depth
+  except (ValueError, IndexError) as err:
+    where = f'the row after section {prev_section} (depth {prev_depth}) of file part {num_sections}' if prev_section is not None else 'the first data row'
+    raise InputError(f'Could not read the section number and depth of {where}: {err}') from err
+
+  state['num_sections'] = num_sections
+  state['prev_section'] = prev_section
+  state['prev_depth'] = prev_depth
+
+
+def _sort_value(value):
+  # Numbers sort by value, ahead of text (including blanks), which sorts as text
+  try:
+    number = float(value)
+  except ValueError:
+    return (1, 0.0, value)
+  return (0, number, '') if number == number else (1, 0.0, value)
+
+
+def sort_columns(header, sort_by):
+  # Column indexes for a list of column names or numbers
+  columns = []
+  for column in sort_by:
+    if isinstance(column, int):
+      columns.append(column)
+    elif column in header:
+      columns.append(header.index(column))
+    elif column.isdigit():
+      columns.append(int(column))
+    else:
+      raise ColumnNotFoundError(f"Cannot find sort column '{column}'. The columns are: {', '.join(header)}.")
+  return columns
+
+
+def _write_sort_run(rows, filename, block_rows):
+  with open(filename, 'wb') as f:
+    for i in range(0, len(rows), block_rows):
+      pickle.dump(rows[i:i + block_rows], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_sort_run(filename):
+  with open(filename, 'rb') as f:
+    while True:
+      try:
+        block = pickle.load(f)
+      except EOFError:
+        return
+      yield from block
+
+
+def _blocks(rows, block_rows):
+  rows = iter(rows)
+  while True:
+    block = list(itertools.islice(rows, block_rows))
+    if not block:
+      return
+    yield block
+
+
+def external_sort(rows, columns, run_rows=SORT_RUN_ROWS, temp_dir=None):
+  # Yield rows sorted by the given columns, holding at most run_rows rows in
+  # memory. Each run of run_rows rows is sorted and spilled to a temporary
+  # file, and the runs are merged (in several passes if there are more than
+  # SORT_MERGE_WIDTH). The sort is stable, so rows with equal keys stay in
+  # the order they were read. Nothing is spilled if everything fits in one run.
+  def key(row):
+    return tuple(_sort_value(row[c]) for c in columns)
+
+  rows = iter(rows)
+  run = list(itertools.islice(rows, run_rows))
+  run.sort(key=key)
+  # Look one row ahead so an input of exactly run_rows rows isn't spilled
+  following = list(itertools.islice(rows, 1))
+  if not following:
+    yield from run
+    return
+  rows = itertools.chain(following, rows)
+  block_rows = max(run_rows // SORT_MERGE_WIDTH, SORT_MIN_BLOCK_ROWS)
+
+  with tempfile.TemporaryDirectory(prefix='coreid-sort-', dir=temp_dir) as sort_dir:
+    run_files = []
+    while run:
+      run_files.append(os.path.join(sort_dir, f'run{len(run_files)}.pickle'))
+      _write_sort_run(run, run_files[-1], block_rows)
+      run = list(itertools.islice(rows, run_rows))
+      run.sort(key=key)
+
+    # Merge neighbouring runs so the order of equal keys is kept
+    merge_pass = 0
+    while len(run_files) > SORT_MERGE_WIDTH:
+      merged_files = []
+      for i in range(0, len(run_files), SORT_MERGE_WIDTH):
+        group = run_files[i:i + SORT_MERGE_WIDTH]
+        merged_files.append(os.path.join(sort_dir, f'merge{merge_pass}-{len(merged_files)}.pickle'))
+        with open(merged_files[-1], 'wb') as f:
+          for block in _blocks(heapq.merge(*[_read_sort_run(filename) for filename in group], key=key), block_rows):
+            pickle.dump(block, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for filename in group:
+          os.remove(filename)
+      run_files = merged_files
+      merge_pass += 1
+
+    readers = [_read_sort_run(filename) for filename in run_files]
+    try:
+      yield from heapq.merge(*readers, key=key)
+    finally:
+      # Close the run files before the directory is removed
+      for reader in readers:
+        reader.close()
+
+
+def compile_part_table(sectionDict):
+  # Turn the part_section dictionary into a list of core names and a dense
+  # table[part][column] of indexes into it, -1 where there is no core. Columns
+  # are looked up by the section number as it appears in the file, so (as with
+  # the part_section keys) a section like '01' never matches the core list.
+  core_names = list(sectionDict.values())
+  keys = [k.split('_') for k in sectionDict.keys()]
+  columns = {}
+  for _, section in keys:
+    columns.setdefault(section, len(columns))
+  table = [[-1] * len(columns) for _ in range(max(int(part) for part, _ in keys) + 1 if keys else 0)]
+  for i, (part, section) in enumerate(keys):
+    table[int(part)][columns[section]] = i
+  return core_names, table, columns
+
+
+class CoreList:
+  # A core list compiled for matching: the part_section -> coreID dictionary and
+  # the part table built from it. Compile one with CoreList.from_file() (or from
+  # a dictionary) and reuse it for any number of runs.
+  def __init__(self, section_dict):
+    self.section_dict = section_dict
+    self.core_names, self.table, self.columns = compile_part_table(section_dict)
+    self._numpy_lookup = None
+
+  @classmethod
+  def from_file(cls, core_list_filename, use_cache=True, verbose=False):
+    return cls(read_core_list(core_list_filename, use_cache=use_cache, verbose=verbose))
+
+  def numpy_lookup(self):
+    # What the numpy engine matches with, built on first use: the part table as
+    # an array, the plain section numbers of its columns (sorted, for
+    # searchsorted) and the column of each, and the coreIDs as CSV fields in
+    # one byte array with the start and length of each.
+    if self._numpy_lookup is None:
+      table = np.array(self.table, dtype=np.int64).reshape(len(self.table), len(self.columns))
+      keys = sorted((int(section), column) for section, column in self.columns.items() if section.isascii() and section.isdigit() and str(int(section)) == section)
+      names = [_csv_field(name).encode('utf-8') for name in self.core_names]
+      name_lengths = np.array([len(name) for name in names], dtype=np.int64)
+      self._numpy_lookup = (table,
+                            np.array([section for section, _ in keys], dtype=np.int64),
+                            np.array([column for _, column in keys], dtype=np.int64),
+                            np.frombuffer(b''.join(names), dtype=np.uint8),
+                            np.cumsum(name_lengths) - name_lengths,
+                            name_lengths)
+    return self._numpy_lookup
+
+  def __len__(self):
+    return len(self.section_dict)
+
+
+def _as_core_list(core_list):
+  return core_list if isinstance(core_list, CoreList) else CoreList(core_list)
+
+
+def read_export(lines, header_row=0, units_row=1, start_row=2):
+  # Split an MSCL export, given as a text file object or any iterable of lines,
+  # into (header, units, rows). rows lazily splits the data rows into lists of strings.
+  if not (0 <= header_row < start_row and 0 <= units_row < start_row and header_row != units_row):
+    raise OptionsError(f'The header row ({header_row}) and units row ({units_row}) must be different rows before the start row ({start_row}).')
+  rows = (line.strip().split(',') for line in lines)
+  pre_rows = _read_pre_rows(rows, start_row)
+  return pre_rows[header_row], pre_rows[units_row], rows
+
+
+def _read_pre_rows(rows, start_row):
+  # The first start_row rows (or lines) of an export, leaving the rest in rows
+  pre_rows = list(itertools.islice(rows, start_row))
+  if len(pre_rows) < start_row:
+    raise InputError(f'The export ends before the start row ({start_row}).')
+  return pre_rows
+
+
+def assign_core_ids(rows, core_list, section_column=None, depth_column=None, header=None, state=None):
+  # Lazily yield (matched, key, row) for each data row. key is the coreID for a
+  # matched row and the Part_Section for an unmatched one; rows are yielded as
+  # they came in. rows is an iterable of rows (lists of strings) or of CSV lines,
+  # such as the rows from read_export(). core_list is a CoreList or a
+  # part_section -> coreID dictionary. Columns not given are found in header.
+  # Raises ColumnNotFoundError or InputError instead of exiting.
+  core_list = _as_core_list(core_list)
+  section_column, depth_column = find_columns(header or [], {'section_column': section_column, 'depth_column': depth_column})
+
+  rows = iter(rows)
+  first = next(rows, None)
+  if first is None:
+    return
+  rows = itertools.chain([first], rows)
+  if isinstance(first, str):
+    rows = (line.strip().split(',') for line in rows)
+
+  core_names, table, columns = core_list.core_names, core_list.table, core_list.columns
+  num_parts = len(table)
+  for part, row in assign_parts(rows, section_column, depth_column, state):
+    section = row[section_column]
+    column = columns.get(section)
+    core_index = table[part][column] if column is not None and part < num_parts else -1
+    if core_index >= 0:
+      yield True, core_names[core_index], row
+    else:
+      yield False, str(part) + '_' + section, row
+
+
+def match_rows(rows, section_column, section_depth_column, sectionDict, chunk_size=CHUNK_SIZE, state=None, timer=None):
+  # Yield (matched_rows, unmatched_rows) batches. Matched rows have the section
+  # number replaced with the coreID, unmatched rows get their part_section appended.
+  timer = timer or PhaseTimer(enabled=False)
+  matched_rows = []
+  unmatched_rows = []
+  for matched, key, row in timer.wrap('assign', assign_core_ids(rows, sectionDict, section_column, section_depth_column, state=state)):
+    if matched:
+      row[section_column] = key
+      matched_rows.append(row)
+    else:
+      row.append(key)
+      unmatched_rows.append(row)
+    if len(matched_rows) + len(unmatched_rows) >= chunk_size:
+      yield matched_rows, unmatched_rows
+      matched_rows = []
+      unmatched_rows = []
+  if matched_rows or unmatched_rows:
+    yield matched_rows, unmatched_rows
+
+
+class EncodedRows:
+  # A batch of rows already formatted as CSV bytes, written straight to the
+  # output file. core_names holds the coreIDs used by the rows.
+  def __init__(self, data, count, core_names=()):
+    self.data = data
+    self.count = count
+    self.core_names = core_names
+
+  def __len__(self):
+    return self.count
+
+
+def _csv_line(row):
+  # One row formatted the way csv.writer formats it in apply_names, as UTF-8 bytes
+  buffer = io.StringIO()
+  csv.writer(buffer, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL, lineterminator='').writerow(row)
+  return buffer.getvalue().encode('utf-8')
+
+
+def _csv_field(value):
+  if any(c in value for c in ',"\r\n'):
+    return '"' + value.replace('"', '""') + '"'
+  return value
+
+
+def _field_span(line, column):
+  # Byte offsets of a comma-separated field in a line, or None if there are too few fields
+  start = 0
+  for _ in range(column):
+    start = line.find(b',', start) + 1
+    if start == 0:
+      return None
+  end = line.find(b',', start)
+  return start, (end if end >= 0 else len(line))
+
+
+def _mapped_lines(f, position):
+  # Yield the lines of a memory-mapped file, tracking the offset reached in position
+  if os.fstat(f.fileno()).st_size == 0:
+    return
+  with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+    for line in iter(mapped.readline, b''):
+      position['offset'] += len(line)
+      yield line
+
+
+def _key_field_records(lines, section_column, section_depth_column):
+  # Yield (section, depth, line, start, end, row) for each raw line. Only the
+  # section and depth fields are decoded; start:end is where the section number
+  # sits in the line so the rest of the line can be copied to the output as is.
+  # Lines the plain byte copy can't reproduce exactly (quotes that csv.writer
+  # would escape, lone carriage returns, non-ASCII whitespace at either end,
+  # too few fields) are decoded and split as usual, with row set instead of line.
+  for line in lines:
+    line = line.strip()
+    if line and 0x20 <= line[0] < 0x80 and 0x20 <= line[-1] < 0x80 and b'"' not in line and b'\r' not in line:
+      section_span = _field_span(line, section_column)
+      depth_span = _field_span(line, section_depth_column)
+      if section_span is not None and depth_span is not None:
+        yield (line[section_span[0]:section_span[1]].decode('utf-8'), line[depth_span[0]:depth_span[1]].decode('utf-8'),
+               line, section_span[0], section_span[1], None)
+        continue
+    for text in line.decode('utf-8').split('\r'):
+      row = text.strip().split(',')
+      yield row[section_column], row[section_depth_column], None, 0, 0, row
+
+
+def match_lines_mmap(lines, section_column, section_depth_column, sectionDict, chunk_size=CHUNK_SIZE, state=None, timer=None):
+  # Byte-level version of match_rows for raw lines from a memory-mapped file.
+  # Matched lines are copied with just the section number swapped for the coreID;
+  # unmatched lines get ',part_section' appended. Batches are EncodedRows.
+  timer = timer or PhaseTimer(enabled=False)
+  core_list = _as_core_list(sectionDict)
+  core_names, table, columns = core_list.core_names, core_list.table, core_list.columns
+  num_parts = len(table)
+  core_name_fields = [_csv_field(name).encode('utf-8') for name in core_names]
+  records = assign_parts(_key_field_records(lines, section_column, section_depth_column), 0, 1, state)
+
+  matched_lines = []
+  matched_keys = set()
+  unmatched_lines = []
+  for part, (section, depth, line, start, end, row) in timer.wrap('assign', records):
+    column = columns.get(section)
+    core_index = table[part][column] if column is not None and part < num_parts else -1
+    if core_index >= 0:
+      matched_keys.add(core_index)
+      if line is not None:
+        matched_lines.append(line[:start] + core_name_fields[core_index] + line[end:])
+      else:
+        row[section_column] = core_names[core_index]
+        matched_lines.append(_csv_line(row))
+    else:
+      part_section = str(part) + '_' + section
+      if line is not None:
+        unmatched_lines.append(line + b',' + part_section.encode('utf-8'))
+      else:
+        row.append(part_section)
+        unmatched_lines.append(_csv_line(row))
+
+    if len(matched_lines) + len(unmatched_lines) >= chunk_size:
+      yield (EncodedRows(b''.join(l + b'\r\n' for l in matched_lines), len(matched_lines), {core_names[k] for k in matched_keys}),
+             EncodedRows(b''.join(l + b'\r\n' for l in unmatched_lines), len(unmatched_lines)))
+      matched_lines = []
+      matched_keys = set()
+      unmatched_lines = []
+  if matched_lines or unmatched_lines:
+    yield (EncodedRows(b''.join(l + b'\r\n' for l in matched_lines), len(matched_lines), {core_names[k] for k in matched_keys}),
+           EncodedRows(b''.join(l + b'\r\n' for l in unmatched_lines), len(unmatched_lines)))
+
+
+def _read_blocks(f, size=NUMPY_BLOCK_SIZE):
+  # Yield blocks of about size bytes from a binary file, each ending at a line end
+  # (except the last block if the file doesn't end with one)
+  tail = b''
+  while True:
+    data = f.read(size)
+    if not data:
+      if tail:
+        yield tail
+      return
+    data = tail + data
+    cut = data.rfind(b'\n') + 1
+    tail = data[cut:]
+    if cut:
+      yield data[:cut]
+
+
+def _gather(source, starts, lengths):
+  # source[starts[i]:starts[i] + lengths[i]] for every i, concatenated, as bytes
+  offsets = np.cumsum(lengths) - lengths
+  index = np.repeat(starts - offsets, lengths) + np.arange(int(lengths.sum()))
+  return source[index].tobytes()
+
+
+def _match_block_numpy(block, section_column, section_depth_column, core_list, state):
+  # Match a block of raw lines with array operations only: the key fields are
+  # found from the positions of the commas and line ends, parsed as arrays, and
+  # each output is gathered from the block (and the coreIDs) in one go. Returns
+  # None without touching state if any line needs match_rows instead (quotes,
+  # lone carriage returns, whitespace at either end, too few fields, key fields
+  # that aren't plain numbers, or text that isn't UTF-8), so those lines come
+  # out exactly as the python engine writes them.
+  buf = np.frombuffer(block, dtype=np.uint8)
+  size = len(buf)
+  newlines = np.flatnonzero(buf == 10)
+  starts = np.concatenate(([0], newlines + 1))
+  ends = np.append(newlines, size)
+  if block.endswith(b'\n'):
+    starts = starts[:-1]
+    ends = ends[:-1]
+  if not len(starts) or b'"' in block:
+    return None
+  if buf.max() >= 0x80:
+    try:
+      block.decode('utf-8')
+    except UnicodeDecodeError:
+      return None
+  crlf = (ends > starts) & (buf[np.maximum(ends - 1, 0)] == 13)
+  ends = ends - crlf
+  if block.count(b'\r') != crlf.sum() or (ends == starts).any():
+    return None
+  first = buf[starts]
+  last = buf[ends - 1]
+  if ((first < 0x21) | (first > 0x7e) | (last < 0x21) | (last > 0x7e)).any():
+    return None
+
+  commas = np.flatnonzero(buf == 44)
+  first_comma = np.searchsorted(commas, starts)
+  comma_count = np.searchsorted(commas, ends) - first_comma
+  if (comma_count < max(section_column, section_depth_column)).any():
+    return None
+  commas = np.append(commas, size)
+
+  def field(column):
+    start = starts if column == 0 else commas[first_comma + column - 1] + 1
+    end = np.where(comma_count > column, commas[np.minimum(first_comma + column, len(commas) - 1)], ends)
+    return start, end, end - start
+
+  def field_bytes(start, length):
+    # A row per line holding the field, zero padded to the longest one
+    width = int(length.max())
+    inside = np.arange(width) < length[:, None]
+    chars = buf[np.minimum(start[:, None] + np.arange(width), size - 1)]
+    chars[~inside] = 0
+    return chars, inside
+
+  # Sections must be plain digits without leading zeros; anything else is left
+  # to the per-line engines, which key sections by their text
+  section_start, section_end, section_length = field(section_column)
+  if section_length.min() < 1 or section_length.max() > 18:
+    return None
+  digits, inside = field_bytes(section_start, section_length)
+  digits = digits.astype(np.int64) - 48
+  digits[~inside] = 0
+  if ((digits < 0) | (digits > 9)).any() or ((section_length > 1) & (digits[:, 0] == 0)).any():
+    return None
+  sections = np.zeros(len(starts), dtype=np.int64)
+  for j in range(digits.shape[1]):
+    sections = np.where(inside[:, j], sections * 10 + digits[:, j], sections)
+
+  depth_start, depth_end, depth_length = field(section_depth_column)
+  if depth_length.min() < 1 or depth_length.max() > 32:
+    return None
+  chars, _ = field_bytes(depth_start, depth_length)
+  if not np.isin(chars, np.frombuffer(NUMPY_DEPTH_BYTES, dtype=np.uint8)).all():
+    return None
+  try:
+    depths = chars.view(f'S{chars.shape[1]}').ravel().astype(np.float64)
+  except ValueError:
+    return None
+
+  # A new file part starts where the section goes down, or stays the same while
+  # the depth goes down, carrying on from the last row of the previous block
+  if state['prev_section'] is not None:
+    try:
+      prev_section = np.int64(int(state['prev_section']))
+      prev_depth = float(state['prev_depth'])
+    except (ValueError, OverflowError):
+      return None
+    sections_ext = np.concatenate(([prev_section], sections))
+    depths_ext = np.concatenate(([prev_depth], depths))
+  else:
+    sections_ext = np.concatenate((sections[:1], sections))
+    depths_ext = np.concatenate((depths[:1], depths))
+  new_part = (sections_ext[1:] < sections_ext[:-1]) | ((sections_ext[1:] == sections_ext[:-1]) & (depths_ext[1:] < depths_ext[:-1]))
+  parts = state['num_sections'] + np.cumsum(new_part)
+
+  table, key_sections, key_columns, name_bytes, name_starts, name_lengths = core_list.numpy_lookup()
+  core_index = np.full(len(starts), -1, dtype=np.int64)
+  if len(key_sections):
+    key = np.minimum(np.searchsorted(key_sections, sections), len(key_sections) - 1)
+    valid = (key_sections[key] == sections) & (parts < table.shape[0])
+    core_index[valid] = table[parts[valid], key_columns[key[valid]]]
+  is_matched = core_index >= 0
+
+  # Unmatched rows get ',part_section' appended, from the part numbers they use
+  unmatched_parts, part_index = np.unique(parts[~is_matched], return_inverse=True)
+  part_texts = [str(part).encode('ascii') for part in unmatched_parts.tolist()]
+  part_lengths = np.array([len(text) for text in part_texts], dtype=np.int64)
+  punctuation = size + len(name_bytes)
+  part_offset = punctuation + 4
+  source = np.concatenate((buf, name_bytes, np.frombuffer(b',_\r\n' + b''.join(part_texts), dtype=np.uint8)))
+  comma, underscore, line_end = punctuation, punctuation + 1, punctuation + 2
+
+  index = core_index[is_matched]
+  m_starts, m_ends = starts[is_matched], ends[is_matched]
+  m_section_start, m_section_end = section_start[is_matched], section_end[is_matched]
+  matched = _gather(source,
+                    np.stack([m_starts, size + name_starts[index], m_section_end, np.full(len(index), line_end)], axis=1).ravel(),
+                    np.stack([m_section_start - m_starts, name_lengths[index], m_ends - m_section_end, np.full(len(index), 2)], axis=1).ravel())
+  u_starts, u_ends = starts[~is_matched], ends[~is_matched]
+  count = len(u_starts)
+  unmatched = _gather(source,
+                      np.stack([u_starts, np.full(count, comma), part_offset + (np.cumsum(part_lengths) - part_lengths)[part_index], np.full(count, underscore), section_start[~is_matched], np.full(count, line_end)], axis=1).ravel(),
+                      np.stack([u_ends - u_starts, np.ones(count, dtype=np.int64), part_lengths[part_index], np.ones(count, dtype=np.int64), section_length[~is_matched], np.full(count, 2)], axis=1).ravel())
+
+  state['num_sections'] = int(parts[-1])
+  state['prev_section'] = block[section_start[-1]:section_end[-1]].decode('ascii')
+  state['prev_depth'] = block[depth_start[-1]:depth_end[-1]].decode('ascii')
+  return (EncodedRows(matched, len(index), {core_list.core_names[i] for i in np.unique(index).tolist()}),
+          EncodedRows(unmatched, count))
+
+
+def match_rows_numpy(rows, section_column, section_depth_column, sectionDict, chunk_size=CHUNK_SIZE, state=None, timer=None):
+  # Vectorized version of match_rows. rows is an iterable of raw byte blocks of
+  # complete lines (see _read_blocks), or of rows as match_rows takes them,
+  # which are joined back into lines chunk_size rows at a time. Each block is
+  # matched with _match_block_numpy; the rare block it can't handle is split
+  # into rows as a text file would be and goes through match_rows instead.
+  timer = timer or PhaseTimer(enabled=False)
+  core_list = _as_core_list(sectionDict)
+  if state is None:
+    state = new_part_state()
+
+  rows = iter(rows)
+  while True:
+    chunk = list(itertools.islice(rows, chunk_size))
+    if not chunk:
+      return
+    for block in chunk if isinstance(chunk[0], bytes) else [chunk]:
+      if isinstance(block, bytes):
+        with timer.phase('assign'):
+          batch = _match_block_numpy(block, section_column, section_depth_column, core_list, state)
+        if batch is None:
+          block = [line.strip().split(',') for line in io.StringIO(block.decode('utf-8'), newline=None)]
+      else:
+        with timer.phase('assign'):
+          batch = _match_block_numpy('\n'.join(','.join(row) for row in block).encode('utf-8'), section_column, section_depth_column, core_list, state)
+      if batch is None:
+        batch, = match_rows(block, section_column, section_depth_column, core_list, chunk_size=len(block) + 1, state=state, timer=timer)
+      yield batch
+
+
+def _chunk_boundaries(f, start, end, count):
+  # Split start:end of a binary file into up to count byte ranges that begin at line starts
+  boundaries = [start]
+  for i in range(1, count):
+    f.seek(max(start + (end - start) * i // count - 1, boundaries[-1]))
+    f.readline()
+    if f.tell() >= end:
+      break
+    if f.tell() > boundaries[-1]:
+      boundaries.append(f.tell())
+  boundaries.append(end)
+  return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _range_lines(mapped, start, end):
+  mapped.seek(start)
+  while mapped.tell() < end:
+    yield mapped.readline()
+
+
+def _scan_chunk(input_file, start, end, section_column, section_depth_column):
+  # First pass of a parallel run: the key fields of a chunk's first and last rows
+  # and the number of new parts that start inside the chunk
+  state = new_part_state()
+  first = None
+  with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+    records = _key_field_records(_range_lines(mapped, start, end), section_column, section_depth_column)
+    for _, (section, depth, *_) in assign_parts(records, 0, 1, state):
+      if first is None:
+        first = (section, depth)
+  return first, state
+
+
+def _match_chunk(input_file, start, end, section_column, section_depth_column, state):
+  # Second pass of a parallel run: match a chunk starting from its part state
+  with open(input_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+    batches = list(match_lines_mmap(_range_lines(mapped, start, end), section_column, section_depth_column, _batch_core_list, state=state))
+  return (EncodedRows(b''.join(m.data for m, _ in batches), sum(len(m) for m, _ in batches), set().union(*(m.core_names for m, _ in batches))),
+          EncodedRows(b''.join(u.data for _, u in batches), sum(len(u) for _, u in batches)))
+
+
+def match_file_parallel(input_file, data_start, section_column, section_depth_column, sectionDict, jobs, state=None, timer=None, position=None):
+  # Parallel version of match_lines_mmap for the data rows of an uncompressed
+  # file, starting at byte data_start. The file is split into chunks at line
+  # boundaries. Workers first count the new parts inside each chunk; a prefix
+  # sum over the chunks (checking each chunk's first row against the previous
+  # chunk's last row) gives each chunk's starting part state. Workers then match
+  # the chunks, which are yielded in order as (matched, unmatched) EncodedRows.
+  # position['offset'] is set to the end of the last chunk yielded.
+  timer = timer or PhaseTimer(enabled=False)
+  if state is None:
+    state = new_part_state()
+  if position is None:
+    position = {'offset': data_start}
+
+  with open(input_file, 'rb') as f:
+    end = os.fstat(f.fileno()).st_size
+    chunks = _chunk_boundaries(f, data_start, end, max(jobs, -(-(end - data_start) // PARALLEL_CHUNK_BYTES)))
+  if data_start >= end:
+    return
+
+  executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker, initargs=(sectionDict,))
+  pending = collections.deque()
+  try:
+    with timer.phase('assign'):
+      scans = list(executor.map(_scan_chunk, *zip(*[(input_file, start, stop, section_column, section_depth_column) for start, stop in chunks])))
+      chunk_states = []
+      for first, chunk_state in scans:
+        chunk_states.append(dict(state))
+        if first is None:
+          continue
+        # The chunk's first row is compared with the last row before it, then
+        # the new parts found inside the chunk are added
+        for _ in assign_parts([first], 0, 1, state):
+          pass
+        state['num_sections'] += chunk_state['num_sections'] - 1
+        state['prev_section'] = chunk_state['prev_section']
+        state['prev_depth'] = chunk_state['prev_depth']
+
+    # Keep a couple of chunks per worker in flight so finished chunks waiting to
+    # be written don't pile up in memory
+    chunk_iter = iter(zip(chunks, chunk_states))
+    for (start, stop), chunk_state in itertools.islice(chunk_iter, 2 * jobs):
+      pending.append((stop, executor.submit(_match_chunk, input_file, start, stop, section_column, section_depth_column, chunk_state)))
+    while pending:
+      stop, future = pending.popleft()
+      batch = future.result()
+      for (next_start, next_stop), chunk_state in itertools.islice(chunk_iter, 1):
+        pending.append((next_stop, executor.submit(_match_chunk, input_file, next_start, next_stop, section_column, section_depth_column, chunk_state)))
+      position['offset'] = stop
+      yield batch
+  finally:
+    # Chunks not started yet are dropped (shutdown's cancel_futures needs Python 3.9)
+    for _, future in pending:
+      future.cancel()
+    executor.shutdown(wait=True)
+
+
+def _write_rows(f, csvwriter, rows):
+  # f is None for a columnar.ColumnarWriter, which takes split rows
+  if isinstance(rows, EncodedRows):
+    if f is None:
+      csvwriter.writerows(csv.reader(io.StringIO(rows.data.decode('utf-8'), newline='')))
+    else:
+      f.flush()
+      f.buffer.write(rows.data)
+  else:
+    csvwriter.writerows(rows)
+
+
+def _close_outputs(outputs):
+  # Close every output even if closing one of them fails
+  with contextlib.ExitStack() as stack:
+    for f, writer in outputs:
+      stack.callback((writer if f is None else f).close)
+
+
+def _close_writers(writers):
+  # Close every OutputWriter (skipping None) even if closing one of them fails
+  with contextlib.ExitStack() as stack:
+    for writer in writers:
+      if writer is not None:
+        stack.callback(writer.close)
+
+
+class OutputWriter:
+  # Writes batches of rows to a list of (file, writer) outputs. With background
+  # set, batches go through a bounded queue to a writer thread instead, so
+  # writing overlaps with reading and matching while at most queue_size batches
+  # wait in memory. An error on the writer thread is raised by the next call.
+  def __init__(self, outputs, background=False, queue_size=WRITE_QUEUE_SIZE):
+    self.outputs = outputs
+    self.error = None
+    self.queue = None
+    self.thread = None
+    if background:
+      self.queue = queue.Queue(maxsize=queue_size)
+      self.thread = threading.Thread(target=self._run, daemon=True)
+      self.thread.start()
+
+  def _write(self, rows):
+    for f, writer in self.outputs:
+      _write_rows(f, writer, rows)
+
+  def _run(self):
+    # Batches after an error are taken off the queue but not written, so the
+    # main thread never blocks on a full queue
+    while True:
+      rows = self.queue.get()
+      try:
+        if rows is None:
+          return
+        if self.error is None:
+          self._write(rows)
+      except BaseException as err:
+        self.error = err
+      finally:
+        self.queue.task_done()
+
+  def _raise_error(self):
+    if self.error is not None:
+      error, self.error = self.error, None
+      raise error
+
+  def write(self, rows):
+    if self.thread is None:
+      self._write(rows)
+    else:
+      self._raise_error()
+      self.queue.put(rows)
+
+  def flush(self):
+    # Wait for the queued batches to be written, then flush the files
+    if self.thread is not None:
+      self.queue.join()
+      self._raise_error()
+    for f, _ in self.outputs:
+      if f is not None:
+        f.flush()
+
+  def close(self):
+    if self.thread is not None and self.thread.is_alive():
+      self.queue.put(None)
+      self.thread.join()
+    _close_outputs(self.outputs)
+    self._raise_error()
 
-  # Default values
-  header_row = 0
-  units_row = 1
-  start_row = 2
 
-  ### Import the data
-  mscl_data = []
-  section_list = []
+def _digest(data):
+  return hashlib.sha256(data).hexdigest()
 
-  with open(input_file, 'r', encoding='utf-8-sig') as f:
-    mscl_data = [r.strip().split(',') for r in f.read().splitlines()]
 
+def _core_list_digest(sectionDict):
+  return _digest(json.dumps(sorted(sectionDict.items())).encode('utf-8'))
+
+
+def _read_complete_lines(f, position):
+  # Yield decoded lines from a binary file. position tracks the offset and bytes
+  # of the last complete line read; a last line without a line ending (which may
+  # still be being written) is kept in position['tail'] instead.
+  for line in f:
+    if not line.endswith(b'\n'):
+      position['tail'] = line
+      break
+    position['offset'] += len(line)
+    position['last_line'] = line
+    yield line.decode('utf-8')
+
+
+def _tail_batches(position, match_function, section_column, section_depth_column, sectionDict, state):
+  # Match the unterminated last line without advancing the part state, so it is
+  # written out now but processed again (possibly completed) on the next run.
+  # A line cut off part way through a row is left for the next run.
+  if not position['tail']:
+    return
+  try:
+    row = position['tail'].decode('utf-8').strip().split(',')
+    batches = list(match_function([row], section_column, section_depth_column, sectionDict, state=dict(state)))
+  except (ValueError, IndexError, InputError):
+    return
+  yield from batches
+
+
+def read_checkpoint(checkpoint_filename, f, expected, verbose=False):
+  # Return the checkpoint saved by the last incremental run if the input file
+  # still starts with what was processed then and the outputs haven't changed
+  # since, otherwise None so the caller rebuilds the outputs from scratch.
+  try:
+    with open(checkpoint_filename, 'r', encoding='utf-8') as cf:
+      checkpoint = json.load(cf)
+  except (OSError, ValueError):
+    return None
+
+  reason = None
+  if any(checkpoint.get(k) != v for k, v in expected.items()):
+    reason = 'the checkpoint was made with different settings, header rows or core list'
+  elif os.fstat(f.fileno()).st_size < checkpoint['offset']:
+    reason = 'the input file is shorter than when the checkpoint was made'
+  elif not os.path.isfile(checkpoint['matched_filename']) or os.path.getsize(checkpoint['matched_filename']) != checkpoint['matched_final_size']:
+    reason = f"{checkpoint['matched_filename']} has changed since the checkpoint was made"
+  elif checkpoint['unmatched_final_size'] and (not os.path.isfile(checkpoint['unmatched_filename']) or os.path.getsize(checkpoint['unmatched_filename']) != checkpoint['unmatched_final_size']):
+    reason = f"{checkpoint['unmatched_filename']} has changed since the checkpoint was made"
+  else:
+    f.seek(checkpoint['offset'] - checkpoint['last_line_length'])
+    if _digest(f.read(checkpoint['last_line_length'])) != checkpoint['last_line_digest']:
+      reason = 'the input file has changed since the checkpoint was made'
+
+  if reason is not None:
+    if verbose:
+      print(f'Ignoring checkpoint {checkpoint_filename}: {reason}.')
+    return None
+  return checkpoint
+
+
+def write_checkpoint(checkpoint_filename, checkpoint):
+  temp_filename = f'{checkpoint_filename}.{os.getpid()}.tmp'
+  with open(temp_filename, 'w', encoding='utf-8') as f:
+    json.dump(checkpoint, f, indent=2)
+  os.replace(temp_filename, checkpoint_filename)
+
+
+def find_columns(header, kwargs, verbose=False):
+  # Return (section_column, section_depth_column) for a row of headers.
+  # Columns passed in kwargs (command line/GUI) take precedence.
 
   # Find the section number column:
   #   1) check if it was passed via command line/GUI
   #   2) search the row of headers for one of the expected names
-  #   3) if neither of those succeed, exit and print an error message
-  if 'section_column' in kwargs and kwargs['section_column']:
+  #   3) if neither of those succeed, raise ColumnNotFoundError
+  if 'section_column' in kwargs and kwargs['section_column'] is not None:
     section_column = kwargs['section_column']
     if verbose:
       print(f'Section column passed at command line: {section_column}')
   else:
     for col_name in ['SECT NUM', 'Section', 'SectionID']:
-      if col_name in mscl_data[header_row]:
-        section_column = mscl_data[header_row].index(col_name)
+      if col_name in header:
+        section_column = header.index(col_name)
         if verbose:
           print(f"Section number column found in column {section_column} with name '{col_name}'")
         break
     else:
-      print("ERROR: Cannot find section number column. Please change section number column name to 'Section', 'SectionID', or 'SECT NUM'.")
-      exit(1)
+      raise ColumnNotFoundError("Cannot find section number column. Please change section number column name to 'Section', 'SectionID', or 'SECT NUM'.")
 
   # Find the section depth column:
   #   1) check if it was passed via command line/GUI
   #   2) search the row of headers for one of the expected names
-  #   3) if neither of those succeed, exit and print an error message
-  if 'depth_column' in kwargs and kwargs['depth_column']:
+  #   3) if neither of those succeed, raise ColumnNotFoundError
+  if 'depth_column' in kwargs and kwargs['depth_column'] is not None:
     section_depth_column = kwargs['depth_column']
     if verbose:
       print(f'Section depth column passed at command line: {section_depth_column}')
   else:
     for col_name in ['Section Depth', 'SECT DEPTH']:
-      if col_name in mscl_data[header_row]:
-        section_depth_column = mscl_data[header_row].index(col_name)
+      if col_name in header:
+        section_depth_column = header.index(col_name)
         if verbose:
           print(f"Section depth column found in column {section_depth_column} with name '{col_name}'")
         break
     else:
-      print("ERROR: Cannot find section depth column. Please change section number column name to 'Section Depth' or 'SECT DEPTH'.")
-      exit(1)
+      raise ColumnNotFoundError("Cannot find section depth column. Please change section number column name to 'Section Depth' or 'SECT DEPTH'.")
 
+  return section_column, section_depth_column
 
-  # Build the section list
-  with open(core_list_filename, 'r', encoding='utf-8-sig') as f:
-    rows = f.read().splitlines()
-    section_list = [[int(core_num), core_name] for core_num, core_name in [r.split(',') for r in rows]]
 
-  # Add the filepart_section notation field to the section log
-  num_sections = 1
-  for i, row in enumerate(section_list):
-    if i == 0:
-      row.append('1_' + str(section_list[i][0]))
-    elif i > 0:
-      if section_list[i][0] <= section_list[i-1][0]:
-        num_sections += 1
-      row.append(str(num_sections) + '_' + str(section_list[i][0]))
+class AssignerError(Exception):
+  # Base class for the errors apply_names and assign_core_ids raise; the command
+  # line prints them and exits.
+  pass
 
-  # Build a dictionary for lookup from the list
-  sectionDict = {section[2]: section[1] for section in section_list}
 
-  # Add the part_section notation field to the mscl data
-  num_sections = 1
-  for i, row in enumerate(mscl_data):
-    if i == header_row:
-      row.append('Part_Section')
-    elif i == units_row:
-      row.append('')
-    elif i == start_row:
-      row.append(str(num_sections) + '_' + mscl_data[i][section_column])
-    elif i > start_row:
-      if int(mscl_data[i][section_column]) < int(mscl_data[i-1][section_column]):
-        num_sections += 1
-      elif ((int(mscl_data[i][section_column]) == int(mscl_data[i-1][section_column])) & (float(mscl_data[i][section_depth_column]) < float(mscl_data[i-1][section_depth_column]))):
-        num_sections += 1
-      row.append(str(num_sections) + '_' + mscl_data[i][section_column])
-    else:
-      if verbose:
-        print(f'Ignored row {i} (not header or units row and before start row):\n{row}')
+class ColumnNotFoundError(AssignerError):
+  pass
+
+
+class CoreListError(AssignerError):
+  pass
+
+
+class InputError(AssignerError):
+  # A data row whose section number or depth can't be read
+  pass
+
+
+class OptionsError(AssignerError):
+  # Settings that can't be used, or can't be used together
+  pass
+
+
+class RunCancelled(AssignerError):
+  # Raised by apply_names when its cancel event is set part way through a run
+  pass
 
 
-  ### Build the export lists
-  matched_data = []
-  unmatched_data = []
+class RunReport:
+  # What a run did: row counts, output files, and how the core list was used.
+  # Built in one pass over the core list (duplicates) plus the set of core names
+  # seen while matching (unused cores), so it stays linear in the core list size.
+  # The CLI, Gooey and the Qt GUI all render it through lines().
+  def __init__(self, input_file, core_list_filename, sectionDict, used_cores,
+               matched_filename=None, matched_count=0, unmatched_filename=None, unmatched_count=0):
+    self.input_file = input_file
+    self.core_list_filename = core_list_filename
+    self.matched_filename = matched_filename
+    self.matched_count = matched_count
+    self.unmatched_filename = unmatched_filename
+    self.unmatched_count = unmatched_count
 
-  # Build the export lists, replacing the geotek file section number with the
-  # coreID and removing the extra part_section column if the row was matched.
-  for row in mscl_data[start_row:]:
-    if row[-1] in sectionDict.keys():
-      row[section_column] = sectionDict[row[-1]]
-      matched_data.append(row[:-1])
+    core_name_counts = collections.Counter(sectionDict.values())
+    self.core_count = len(core_name_counts)
+    self.duplicate_cores = {name: count for name, count in sorted(core_name_counts.items()) if count > 1}
+    self.unused_cores = sorted(name for name in core_name_counts if name not in used_cores)
+
+    self.elapsed = None
+    self.profile = None
+
+  def lines(self):
+    lines = []
+    for core_name, core_name_count in self.duplicate_cores.items():
+      lines.append(f'WARNING: Core {core_name} appears in {self.core_list_filename} {str(core_name_count)} times.')
+
+    count_diff = len(self.unused_cores)
+    if (count_diff > 0):
+      lines.append(f'\nWARNING: Not all cores in {self.core_list_filename} were used.')
+      lines.append(f"The following {str(count_diff)} core {'names were' if count_diff != 1 else 'name was'} not used:")
+      for v in self.unused_cores:
+        lines.append(f'\t{v}')
+      lines.append('')
+
+    lines.append(f'{self.matched_count} rows had section names assigned ({self.matched_filename}).')
+    lines.append('There were no unmatched rows.' if self.unmatched_count == 0 else f'There were {str(self.unmatched_count)} unmatched rows ({self.unmatched_filename}).')
+    return lines
+
+  def __str__(self):
+    return '\n'.join(self.lines())
+
+  def to_dict(self):
+    return {'input_file': self.input_file,
+            'core_list': self.core_list_filename,
+            'matched_filename': self.matched_filename,
+            'matched_count': self.matched_count,
+            'unmatched_filename': self.unmatched_filename,
+            'unmatched_count': self.unmatched_count,
+            'core_count': self.core_count,
+            'duplicate_cores': self.duplicate_cores,
+            'unused_cores': self.unused_cores,
+            'elapsed': self.elapsed,
+            'profile': self.profile}
+
+
+class CheckReport:
+  # What a --check preflight found: coverage of the export by the core list,
+  # duplicate and unused cores, and part breaks that look wrong. unused_cores
+  # only covers the rows read, so it is incomplete if the check stopped early.
+  def __init__(self, input_file, core_list_filename, core_list, used_cores,
+               section_column, depth_column, rows=0, matched_count=0, unmatched=None,
+               parts=0, suspicious_breaks=None, stopped_early=False):
+    self.input_file = input_file
+    self.core_list_filename = core_list_filename
+    self.section_column = section_column
+    self.depth_column = depth_column
+    self.rows = rows
+    self.matched_count = matched_count
+    self.unmatched = unmatched or {}
+    self.unmatched_count = sum(self.unmatched.values())
+    self.parts = parts
+    self.core_list_parts = len(core_list.table) - 1 if core_list.table else 0
+    self.suspicious_breaks = suspicious_breaks or []
+    self.stopped_early = stopped_early
+
+    core_name_counts = collections.Counter(core_list.section_dict.values())
+    self.core_count = len(core_name_counts)
+    self.duplicate_cores = {name: count for name, count in sorted(core_name_counts.items()) if count > 1}
+    self.unused_cores = sorted(name for name in core_name_counts if name not in used_cores)
+
+  @property
+  def ok(self):
+    return not (self.stopped_early or self.unmatched_count or self.duplicate_cores or self.unused_cores or self.suspicious_breaks or self.parts != self.core_list_parts)
+
+  def lines(self, max_listed=20):
+    lines = [f'Checked {self.input_file} against {self.core_list_filename} (section column {self.section_column}, depth column {self.depth_column}).']
+    if self.stopped_early:
+      lines.append(f'STOPPED EARLY after {self.rows} rows: more than the allowed number of unmatched rows.')
+    lines.append(f'{self.matched_count} of {self.rows} rows matched a core, {self.unmatched_count} did not.')
+    for part_section, count in sorted(self.unmatched.items(), key=lambda item: -item[1])[:max_listed]:
+      lines.append(f'\t{part_section}: {count} unmatched rows')
+    if len(self.unmatched) > max_listed:
+      lines.append(f'\t... and {len(self.unmatched) - max_listed} more Part_Sections')
+
+    if self.parts != self.core_list_parts and not self.stopped_early:
+      lines.append(f'WARNING: The export has {self.parts} file parts, the core list has {self.core_list_parts}.')
+    for row_number, reason in self.suspicious_breaks[:max_listed]:
+      lines.append(f'WARNING: Part break at row {row_number}: {reason}.')
+    if len(self.suspicious_breaks) > max_listed:
+      lines.append(f'... and {len(self.suspicious_breaks) - max_listed} more suspicious part breaks.')
+
+    for core_name, core_name_count in self.duplicate_cores.items():
+      lines.append(f'WARNING: Core {core_name} appears in {self.core_list_filename} {str(core_name_count)} times.')
+    if self.unused_cores:
+      lines.append(f"WARNING: {len(self.unused_cores)} of {self.core_count} cores were not used{' by the rows checked' if self.stopped_early else ''}: {', '.join(self.unused_cores[:max_listed])}{', ...' if len(self.unused_cores) > max_listed else ''}")
+    lines.append('No problems found.' if self.ok else 'Problems found, see above.')
+    return lines
+
+  def __str__(self):
+    return '\n'.join(self.lines())
+
+  def to_dict(self):
+    return {'input_file': self.input_file,
+            'core_list': self.core_list_filename,
+            'section_column': self.section_column,
+            'depth_column': self.depth_column,
+            'rows': self.rows,
+            'matched_count': self.matched_count,
+            'unmatched_count': self.unmatched_count,
+            'unmatched': self.unmatched,
+            'parts': self.parts,
+            'core_list_parts': self.core_list_parts,
+            'suspicious_breaks': self.suspicious_breaks,
+            'duplicate_cores': self.duplicate_cores,
+            'unused_cores': self.unused_cores,
+            'stopped_early': self.stopped_early,
+            'ok': self.ok}
+
+
+class PhaseTimer:
+  # Accumulates time spent in each phase of a run. Phases can nest, e.g. the
+  # match phase pulls rows through the read phase; each phase is credited only
+  # with the time not spent in the phases inside it. A disabled timer costs
+  # nothing: phase() does no timing and wrap() returns the iterable unchanged.
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.totals = {}
+    self._inner = []
+
+  def _start(self):
+    self._inner.append(0.0)
+    return timeit.default_timer()
+
+  def _stop(self, name, start):
+    elapsed = timeit.default_timer() - start
+    inner = self._inner.pop()
+    self.totals[name] = self.totals.get(name, 0.0) + elapsed - inner
+    if self._inner:
+      self._inner[-1] += elapsed
+
+  @contextlib.contextmanager
+  def _timed(self, name):
+    start = self._start()
+    try:
+      yield
+    finally:
+      self._stop(name, start)
+
+  def phase(self, name):
+    return self._timed(name) if self.enabled else contextlib.nullcontext()
+
+  def wrap(self, name, iterable):
+    # Time each step of an iterator (e.g. reading and splitting a row)
+    if not self.enabled:
+      return iterable
+    return self._wrap(name, iter(iterable))
+
+  def _wrap(self, name, iterator):
+    while True:
+      start = self._start()
+      try:
+        item = next(iterator)
+      except StopIteration:
+        return
+      finally:
+        self._stop(name, start)
+      yield item
+
+
+def peak_memory():
+  # Peak memory use of this process in bytes, or None if it can't be found
+  try:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+  except ImportError:
+    pass
+  try:
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+      _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                  ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                  ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                  ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                  ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+      return counters.PeakWorkingSetSize
+  except (ImportError, AttributeError, OSError):
+    pass
+  return None
+
+
+def apply_names(input_file, core_list_filename, **kwargs):
+  # Run under cProfile and dump the stats if asked to
+  if 'cprofile' in kwargs and kwargs['cprofile']:
+    profiler = cProfile.Profile()
+    report = profiler.runcall(apply_names, input_file, core_list_filename, **dict(kwargs, cprofile=None))
+    profiler.dump_stats(kwargs['cprofile'])
+    return report
+
+  verbose = kwargs['verbose'] if 'verbose' in kwargs else False
+  engine = kwargs['engine'] if 'engine' in kwargs and kwargs['engine'] else 'python'
+  use_cache = kwargs['use_cache'] if 'use_cache' in kwargs else True
+  incremental = kwargs['incremental'] if 'incremental' in kwargs else False
+  profile_report = kwargs['profile_report'] if 'profile_report' in kwargs else None
+  profile = (kwargs['profile'] if 'profile' in kwargs else False) or bool(profile_report)
+  # progress(rows_processed, bytes_read, total_bytes) is called after each batch
+  # is written; setting cancel (a threading.Event) stops the run at the next batch.
+  progress = kwargs['progress'] if 'progress' in kwargs else None
+  cancel = kwargs['cancel'] if 'cancel' in kwargs else None
+  # Outputs are compressed like the input unless compression is given ('none'
+  # for plain CSV) or output_filename ends in .gz, .bz2 or .xz.
+  compression = kwargs['compression'] if 'compression' in kwargs and kwargs['compression'] else None
+  compress_level = kwargs['compress_level'] if 'compress_level' in kwargs else None
+  # The matched rows (and the unmatched rows, if columnar_unmatched) can also
+  # or instead be written as a typed columnar file; see columnar.py.
+  output_format = kwargs['output_format'] if 'output_format' in kwargs and kwargs['output_format'] else 'csv'
+  columnar_unmatched = kwargs['columnar_unmatched'] if 'columnar_unmatched' in kwargs else False
+  # With more than one job the file is split into chunks that are matched across
+  # a pool of worker processes; see match_file_parallel.
+  jobs = kwargs['jobs'] if 'jobs' in kwargs and kwargs['jobs'] else 1
+  parallel = jobs > 1
+  # In a pipelined run the outputs are written by background threads, see OutputWriter
+  pipeline = kwargs['pipeline'] if 'pipeline' in kwargs else False
+  # Rows can be sorted by some columns (names or numbers) before parts are
+  # assigned, for merged or out of order exports; see external_sort.
+  sort_by = kwargs['sort_by'] if 'sort_by' in kwargs and kwargs['sort_by'] else None
+  sort_run_rows = kwargs['sort_run_rows'] if 'sort_run_rows' in kwargs and kwargs['sort_run_rows'] else SORT_RUN_ROWS
+  sort_temp_dir = kwargs['sort_temp_dir'] if 'sort_temp_dir' in kwargs else None
+
+  if engine == 'numpy' and np is None:
+    raise OptionsError("The numpy engine requires NumPy. Install it with 'pip install numpy' or use the python engine.")
+  if engine == 'mmap' and incremental:
+    raise OptionsError('The mmap engine cannot be used for incremental runs. Use the python or numpy engine.')
+
+  start_time = timeit.default_timer()
+  timer = PhaseTimer(enabled=profile)
+
+  # Default values (rows count from 0)
+  header_row = kwargs['header_row'] if 'header_row' in kwargs and kwargs['header_row'] is not None else 0
+  units_row = kwargs['units_row'] if 'units_row' in kwargs and kwargs['units_row'] is not None else 1
+  start_row = kwargs['start_row'] if 'start_row' in kwargs and kwargs['start_row'] is not None else 2
+
+  if not (0 <= header_row < start_row and 0 <= units_row < start_row and header_row != units_row):
+    raise OptionsError(f'The header row ({header_row}) and units row ({units_row}) must be different rows before the start row ({start_row}).')
+
+  input_compression = detect_compression(input_file)
+  if compression is None:
+    if 'output_filename' in kwargs and kwargs['output_filename']:
+      _, ext = split_compression_extension(kwargs['output_filename'])
+      compression = COMPRESSION_EXTENSIONS[ext.lower()] if ext else None
     else:
-      unmatched_data.append(row)
+      compression = input_compression
+  elif compression == 'none':
+    compression = None
+  output_extension = f'.{compression}' if compression else ''
+
+  if compression not in COMPRESSIONS + [None]:
+    raise OptionsError(f"Unknown compression '{compression}'. Use one of {', '.join(COMPRESSIONS)} or none.")
+  if compression and compress_level is not None and not (1 if compression == 'bz2' else 0) <= compress_level <= 9:
+    raise OptionsError(f"Compression level {compress_level} is out of range for {compression} output. Use {'1' if compression == 'bz2' else '0'}-9.")
+  if incremental and (compression or input_compression):
+    raise OptionsError('Incremental runs cannot read or write compressed files.')
+  if output_format not in OUTPUT_FORMATS:
+    raise OptionsError(f"Unknown output format '{output_format}'. Use one of {', '.join(OUTPUT_FORMATS)}.")
+  if incremental and output_format != 'csv':
+    raise OptionsError('Incremental runs can only write CSV output.')
+  if engine == 'mmap' and input_compression:
+    raise OptionsError('The mmap engine cannot read compressed files. Use the python or numpy engine.')
+  if parallel and incremental:
+    raise OptionsError('Incremental runs cannot be split across jobs.')
+  if parallel and input_compression:
+    raise OptionsError('Compressed files cannot be split across jobs. Decompress the input or use one job.')
+  if sort_by and (incremental or parallel or engine == 'mmap'):
+    raise OptionsError('Sorted runs cannot be incremental, split across jobs or use the mmap engine.')
 
-  # Build export names
+  # Build export names (without the input's compression extension)
+  input_name, _ = split_compression_extension(input_file)
   if 'output_filename' in kwargs and kwargs['output_filename']:
     matched_filename = kwargs['output_filename']
-  elif 'unnamed' in input_file:
-    matched_filename = input_file.replace('_unnamed','')
+  elif 'unnamed' in input_name:
+    matched_filename = input_name.replace('_unnamed','') + output_extension
+  else:
+    matched_filename = input_name.split('.')[0] + '_coreID.csv' + output_extension
+
+  if 'unmatched_filename' in kwargs and kwargs['unmatched_filename']:
+    unmatched_filename = kwargs['unmatched_filename']
   else:
-    matched_filename = input_file.split('.')[0] + '_coreID.csv'
-  
-  unmatched_filename = '.'.join(input_file.split('.')[:-1]) + '_unmatched.csv'
-
-  ### Export matched data
-  with open(matched_filename, 'w', encoding='utf-8-sig', newline='') as f:
-    csvwriter = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    csvwriter.writerow(mscl_data[header_row][:-1])
-    csvwriter.writerow(mscl_data[units_row][:-1])
-    for r in matched_data:
-      csvwriter.writerow(r)
-
-  ### Export unmatched data
-  if len(unmatched_data) != 0:
-    with open(unmatched_filename, 'w', encoding='utf-8-sig', newline='') as f:
-      csvwriter = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-      csvwriter.writerow(mscl_data[header_row])
-      csvwriter.writerow(mscl_data[units_row])
-      for r in unmatched_data:
-        csvwriter.writerow(r)
+    unmatched_filename = '.'.join(input_name.split('.')[:-1]) + '_unmatched.csv' + output_extension
+  checkpoint_filename = matched_filename + '.checkpoint.json'
+
+  # Columnar files are named like the CSV outputs, with the .col extension
+  csv_output = output_format != 'columnar'
+  unmatched_csv_output = csv_output or not columnar_unmatched
+  columnar_filename = None
+  unmatched_columnar_filename = None
+  if output_format != 'csv':
+    columnar_filename = os.path.splitext(split_compression_extension(matched_filename)[0])[0] + columnar.EXTENSION
+    if columnar_unmatched:
+      unmatched_columnar_filename = os.path.splitext(split_compression_extension(unmatched_filename)[0])[0] + columnar.EXTENSION
+  # The files the report names: the CSV outputs unless only columnar is written
+  matched_output = matched_filename if csv_output else columnar_filename
+  unmatched_output = unmatched_filename if unmatched_csv_output else unmatched_columnar_filename
+
+  # Incremental runs read the input as bytes so the offset of the last complete
+  # line can be saved and the next run can pick up from there. The mmap engine
+  # maps the file and works on the raw bytes of each line. Compressed input is
+  # opened as bytes too, so progress can follow the position in the compressed file.
+  # Parallel runs only read the header rows here; workers map the rest themselves.
+  # The numpy engine reads raw blocks of lines, unless the rows are sorted first.
+  numpy_blocks = engine == 'numpy' and not (incremental or parallel or sort_by)
+  binary_input = incremental or parallel or engine == 'mmap' or numpy_blocks or input_compression is not None
+  with open(input_file, 'rb' if binary_input else 'r', encoding=None if binary_input else 'utf-8-sig') as f:
+    input_size = os.fstat(f.fileno()).st_size
+    if incremental or parallel:
+      position = {'offset': 0, 'last_line': b'', 'tail': b''}
+      with timer.phase('read'):
+        header_lines = _read_pre_rows(iter(f.readline, b''), start_row)
+        position['offset'] = sum(len(line) for line in header_lines)
+        pre_rows = [line.decode('utf-8-sig' if i == 0 else 'utf-8').strip().split(',') for i, line in enumerate(header_lines)]
+      tell = (lambda: position['offset']) if parallel else f.tell
+    elif engine == 'mmap':
+      position = {'offset': 0}
+      mscl_rows = timer.wrap('read', _mapped_lines(f, position))
+      pre_rows = [line.decode('utf-8-sig' if i == 0 else 'utf-8').strip().split(',') for i, line in enumerate(_read_pre_rows(mscl_rows, start_row))]
+      tell = lambda: position['offset']
+    elif numpy_blocks:
+      stream = open_compressed(f, 'rb', input_compression) if input_compression else f
+      pre_rows = [line.decode('utf-8-sig' if i == 0 else 'utf-8').strip().split(',') for i, line in enumerate(_read_pre_rows(iter(stream.readline, b''), start_row))]
+      mscl_rows = timer.wrap('read', _read_blocks(stream))
+      tell = f.tell
+    else:
+      # Rows are split lazily as the file is read, so only the rows ahead of
+      # start_row are held in memory; data rows are written out as they arrive.
+      if input_compression:
+        lines = open_compressed(f, 'rt', input_compression, encoding='utf-8-sig')
+        tell = f.tell
+      else:
+        lines = f
+        tell = f.buffer.tell
+      mscl_rows = timer.wrap('read', (r.strip().split(',') for r in lines))
+      pre_rows = _read_pre_rows(mscl_rows, start_row)
+
+    ### Import the header rows
+    for i, row in enumerate(pre_rows):
+      if i not in [header_row, units_row] and verbose:
+        print(f'Ignored row {i} (not header or units row and before start row):\n{row}')
+    header = pre_rows[header_row]
+    units = pre_rows[units_row]
+
+    with timer.phase('columns'):
+      section_column, section_depth_column = find_columns(header, kwargs, verbose)
+      if sort_by:
+        sort_by_columns = sort_columns(header, sort_by)
+        if verbose:
+          print(f"Sorting rows by column {', '.join(str(c) for c in sort_by_columns)} before assigning parts")
+
+    # The whole input is read (and spilled in sorted runs) before the first sorted row comes out
+    if sort_by:
+      mscl_rows = timer.wrap('sort', external_sort(mscl_rows, sort_by_columns, run_rows=sort_run_rows, temp_dir=sort_temp_dir))
+
+
+    # A core list already parsed or compiled by the caller (e.g. batch mode) can
+    # be passed in, as a dictionary or a CoreList
+    with timer.phase('core_list'):
+      if 'section_dict' in kwargs and kwargs['section_dict'] is not None:
+        core_list = _as_core_list(kwargs['section_dict'])
+      else:
+        core_list = CoreList.from_file(core_list_filename, use_cache=use_cache, verbose=verbose)
+      sectionDict = core_list.section_dict
+
+    ### Pick up where the last incremental run stopped
+    part_state = new_part_state()
+    matched_count = 0
+    unmatched_count = 0
+    named_set = set()
+    checkpoint = None
+
+    if incremental:
+      expected = {'version': CHECKPOINT_VERSION,
+                  'matched_filename': matched_filename,
+                  'unmatched_filename': unmatched_filename,
+                  'header_digest': _digest(b''.join(header_lines)),
+                  'core_list_digest': _core_list_digest(sectionDict),
+                  'section_column': section_column,
+                  'depth_column': section_depth_column,
+                  'start_row': start_row}
+      checkpoint = read_checkpoint(checkpoint_filename, f, expected, verbose)
+      if checkpoint is not None:
+        f.seek(checkpoint['offset'])
+        position['offset'] = checkpoint['offset']
+        part_state = checkpoint['part_state']
+        matched_count = checkpoint['matched_count']
+        unmatched_count = checkpoint['unmatched_count']
+        named_set = set(checkpoint['used_cores'])
+
+        # Drop the unterminated last line the previous run wrote, it's reprocessed below
+        with open(matched_filename, 'r+b') as f_out:
+          f_out.truncate(checkpoint['matched_size'])
+        if checkpoint['unmatched_count']:
+          with open(unmatched_filename, 'r+b') as f_out:
+            f_out.truncate(checkpoint['unmatched_size'])
+        elif os.path.isfile(unmatched_filename):
+          os.remove(unmatched_filename)
+        if verbose:
+          print(f"Resuming from byte {checkpoint['offset']} of {input_file} ({matched_count + unmatched_count} rows already processed).")
+      elif verbose:
+        print(f'No usable checkpoint for {input_file}, processing the whole file.')
+      mscl_rows = timer.wrap('read', (r.strip().split(',') for r in _read_complete_lines(f, position)))
+    elif os.path.isfile(checkpoint_filename):
+      # A full run makes any checkpoint from an earlier incremental run stale
+      os.remove(checkpoint_filename)
+
+    ### Export the data
+    # Replace the geotek file section number with the coreID if the row was
+    # matched, otherwise write it to the unmatched file with its part_section.
+    # The unmatched file is only created once an unmatched row turns up.
+    # When resuming, new rows are appended to the outputs of the previous run.
+    match_function = {'numpy': match_rows_numpy, 'mmap': match_lines_mmap}.get(engine, match_rows)
+    if parallel:
+      batches = match_file_parallel(input_file, position['offset'], section_column, section_depth_column, sectionDict, jobs, state=part_state, timer=timer, position=position)
+    else:
+      batches = match_function(mscl_rows, section_column, section_depth_column, core_list, state=part_state, timer=timer)
+    if incremental:
+      # None marks the point where every complete line has been written
+      batches = itertools.chain(batches, [None], _tail_batches(position, match_function, section_column, section_depth_column, core_list, part_state))
+    batches = timer.wrap('match', batches)
+
+    # Each output is a (file, writer) pair; columnar outputs have no file
+    matched_outputs = []
+    unmatched_outputs = None
+    matched_sink = OutputWriter(matched_outputs, background=pipeline)
+    unmatched_sink = None
+    buffering = {'buffering': WRITE_BUFFER_SIZE} if pipeline and not compression else {}
+    output_filenames = [filename for filename in [matched_filename if csv_output else None, columnar_filename] if filename]
+
+    try:
+      if csv_output:
+        if checkpoint is not None:
+          f_matched = open(matched_filename, 'a', encoding='utf-8', newline='', **buffering)
+        else:
+          f_matched = open_compressed(matched_filename, 'wt', compression, compress_level, encoding='utf-8-sig', newline='', **buffering)
+        csvwriter = csv.writer(f_matched, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        matched_outputs.append((f_matched, csvwriter))
+        if checkpoint is None:
+          csvwriter.writerow(header)
+          csvwriter.writerow(units)
+      if columnar_filename:
+        matched_outputs.append((None, columnar.ColumnarWriter(columnar_filename, header, units, metadata={'input_file': input_file, 'core_list': core_list_filename, 'version': version})))
+
+      for batch in batches:
+        if batch is None:
+          matched_sink.flush()
+          if unmatched_sink is not None:
+            unmatched_sink.flush()
+          committed = {'matched_count': matched_count,
+                       'unmatched_count': unmatched_count,
+                       'matched_size': os.fstat(f_matched.fileno()).st_size,
+                       'unmatched_size': os.path.getsize(unmatched_filename) if unmatched_count else 0,
+                       'used_cores': sorted(named_set)}
+          continue
+
+        matched_rows, unmatched_rows = batch
+        with timer.phase('matched_write'):
+          matched_sink.write(matched_rows)
+        named_set.update(matched_rows.core_names if isinstance(matched_rows, EncodedRows) else (r[section_column] for r in matched_rows))
+        matched_count += len(matched_rows)
+
+        if unmatched_rows:
+          with timer.phase('unmatched_write'):
+            if unmatched_outputs is None:
+              unmatched_outputs = []
+              if unmatched_csv_output:
+                output_filenames.append(unmatched_filename)
+                if checkpoint is not None and checkpoint['unmatched_count']:
+                  unmatched_file = open(unmatched_filename, 'a', encoding='utf-8', newline='', **buffering)
+                  unmatched_outputs.append((unmatched_file, csv.writer(unmatched_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)))
+                else:
+                  unmatched_file = open_compressed(unmatched_filename, 'wt', compression, compress_level, encoding='utf-8-sig', newline='', **buffering)
+                  unmatched_writer = csv.writer(unmatched_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+                  unmatched_writer.writerow(header + ['Part_Section'])
+                  unmatched_writer.writerow(units + [''])
+                  unmatched_outputs.append((unmatched_file, unmatched_writer))
+              if unmatched_columnar_filename:
+                output_filenames.append(unmatched_columnar_filename)
+                unmatched_outputs.append((None, columnar.ColumnarWriter(unmatched_columnar_filename, header + ['Part_Section'], units + [''], metadata={'input_file': input_file, 'core_list': core_list_filename, 'version': version})))
+              unmatched_sink = OutputWriter(unmatched_outputs, background=pipeline)
+            unmatched_sink.write(unmatched_rows)
+          unmatched_count += len(unmatched_rows)
+
+        if progress is not None:
+          progress(matched_count + unmatched_count, tell(), input_size)
+        if cancel is not None and cancel.is_set():
+          raise RunCancelled(f'Cancelled after {matched_count + unmatched_count} rows of {input_file}.')
+
+      # Close the outputs here, so an error writing the last batches (which
+      # may only turn up on a writer thread now) is cleaned up like any other
+      _close_writers([matched_sink, unmatched_sink])
+    except BaseException as err:
+      # Don't leave half-written outputs (or a checkpoint pointing at them)
+      # behind when a run is cancelled or fails part way. A failed incremental
+      # run keeps its outputs; they no longer match the checkpoint, so the
+      # next run rebuilds them from scratch.
+      with contextlib.suppress(Exception):
+        _close_writers([matched_sink, unmatched_sink])
+      if isinstance(err, RunCancelled) or not incremental:
+        for filename in output_filenames + [checkpoint_filename]:
+          if os.path.isfile(filename):
+            os.remove(filename)
+      raise
+
+    if incremental:
+      with timer.phase('checkpoint'):
+        if position['last_line'] == b'' and checkpoint is not None:
+          last_line_length = checkpoint['last_line_length']
+          last_line_digest = checkpoint['last_line_digest']
+        else:
+          last_line_length = len(position['last_line'])
+          last_line_digest = _digest(position['last_line'])
+        write_checkpoint(checkpoint_filename, dict(expected,
+                                                   **committed,
+                                                   offset=position['offset'],
+                                                   last_line_length=last_line_length,
+                                                   last_line_digest=last_line_digest,
+                                                   part_state=part_state,
+                                                   matched_final_size=os.path.getsize(matched_filename),
+                                                   unmatched_final_size=os.path.getsize(unmatched_filename) if unmatched_count else 0))
 
 
   ### Reporting stuff
-  # Create a set to check unique cores names
-  named_set = set()
+  with timer.phase('report'):
+    report = RunReport(input_file, core_list_filename, sectionDict, named_set,
+                       matched_filename=matched_output,
+                       matched_count=matched_count,
+                       unmatched_filename=unmatched_output if unmatched_count else None,
+                       unmatched_count=unmatched_count)
+    for line in report.lines():
+      print(line)
+
+  end_time = timeit.default_timer()
+  run_profile = None
+  if profile:
+    rows_before = checkpoint['matched_count'] + checkpoint['unmatched_count'] if checkpoint else 0
+    run_profile = {'version': version,
+                   'input_file': input_file,
+                   'core_list': core_list_filename,
+                   'engine': engine,
+                   'jobs': jobs,
+                   'sort_by': sort_by,
+                   'incremental': incremental,
+                   'python': sys.version,
+                   'platform': platform.platform(),
+                   'total_seconds': end_time - start_time,
+                   'phases': {name: timer.totals.get(name, 0.0) for name in PROFILE_PHASES},
+                   'rows': {'processed': matched_count + unmatched_count - rows_before,
+                            'matched': matched_count,
+                            'unmatched': unmatched_count},
+                   'bytes_read': input_size - (checkpoint['offset'] if checkpoint else 0),
+                   'bytes_written': {'matched': os.path.getsize(matched_output) - (checkpoint['matched_size'] if checkpoint else 0),
+                                     'unmatched': (os.path.getsize(unmatched_output) if unmatched_count else 0) - (checkpoint['unmatched_size'] if checkpoint else 0)},
+                   'peak_memory_bytes': peak_memory()}
+    if profile_report:
+      with open(profile_report, 'w', encoding='utf-8') as f:
+        json.dump(run_profile, f, indent=2)
+    if verbose:
+      for name, seconds in run_profile['phases'].items():
+        print(f'  {name:<16}{seconds:>8.2f} s')
 
-  for row in matched_data[start_row:]:
-    named_set.add(row[section_column])
+  if verbose:
+    print(f'Completed in {round((end_time - start_time),2)} seconds.')
 
-  core_name_list = list(sectionDict.values())
-  for core_name in sorted(list(set(core_name_list))):
-    core_name_count = core_name_list.count(core_name)
-    if core_name_count > 1:
-      print(f'WARNING: Core {core_name} appears in {core_list_filename} {str(core_name_count)} times.')
+  report.elapsed = end_time - start_time
+  report.profile = run_profile
+  return report
+
+
+def check_export(input_file, core_list_filename, max_unmatched=None, **kwargs):
+  # Preflight an export without writing anything: only the section and depth
+  # fields of each row are decoded, part numbers and core list coverage are
+  # worked out as in a real run, and part breaks that don't look like a new
+  # file part (a section depth going backwards, or a part starting on a
+  # section the core list doesn't start that part with) are noted. Stops once
+  # more than max_unmatched rows haven't matched. Returns a CheckReport.
+  verbose = kwargs['verbose'] if 'verbose' in kwargs else False
+  use_cache = kwargs['use_cache'] if 'use_cache' in kwargs else True
+  header_row = kwargs['header_row'] if 'header_row' in kwargs and kwargs['header_row'] is not None else 0
+  units_row = kwargs['units_row'] if 'units_row' in kwargs and kwargs['units_row'] is not None else 1
+  start_row = kwargs['start_row'] if 'start_row' in kwargs and kwargs['start_row'] is not None else 2
+
+  if 'section_dict' in kwargs and kwargs['section_dict'] is not None:
+    core_list = _as_core_list(kwargs['section_dict'])
+  else:
+    core_list = CoreList.from_file(core_list_filename, use_cache=use_cache, verbose=verbose)
+  core_names, table, columns = core_list.core_names, core_list.table, core_list.columns
+  num_parts = len(table)
+  # The section each part of the core list starts with
+  part_starts = {}
+  for key in core_list.section_dict:
+    part, section = key.split('_')
+    part_starts.setdefault(int(part), section)
+
+  compression = detect_compression(input_file)
+  with open(input_file, 'rb') as raw:
+    f = open_compressed(raw, 'rb', compression) if compression else raw
+    header_lines = [line.decode('utf-8-sig' if i == 0 else 'utf-8') for i, line in enumerate(itertools.islice(iter(f.readline, b''), start_row))]
+    header, _, _ = read_export(header_lines, header_row, units_row, start_row)
+    section_column, depth_column = find_columns(header, kwargs, verbose)
+
+    used = set()
+    unmatched = collections.Counter()
+    suspicious_breaks = []
+    matched_count = 0
+    unmatched_count = 0
+    rows = 0
+    stopped_early = False
+    prev_part = 1
+    prev_section = None
+    for part, (section, depth, *_) in assign_parts(_key_field_records(f, section_column, depth_column), 0, 1):
+      rows += 1
+      if part != prev_part:
+        row_number = start_row + rows - 1
+        # A break is fine wherever the core list starts that part on the same
+        # section, including a re-scan of the section the last part ended on
+        if part in part_starts and section == part_starts[part]:
+          pass
+        elif section == prev_section:
+          suspicious_breaks.append((row_number, f'section {section} depth went back to {depth}'))
+        elif part in part_starts:
+          suspicious_breaks.append((row_number, f'part {part} starts at section {section}, in the core list it starts at section {part_starts[part]}'))
+        prev_part = part
+      prev_section = section
+
+      column = columns.get(section)
+      core_index = table[part][column] if column is not None and part < num_parts else -1
+      if core_index >= 0:
+        used.add(core_index)
+        matched_count += 1
+      else:
+        unmatched[str(part) + '_' + section] += 1
+        unmatched_count += 1
+        if max_unmatched is not None and unmatched_count > max_unmatched:
+          stopped_early = True
+          break
+
+  report = CheckReport(input_file, core_list_filename, core_list, {core_names[i] for i in used},
+                       section_column, depth_column, rows=rows, matched_count=matched_count,
+                       unmatched=dict(unmatched), parts=prev_part if rows else 0,
+                       suspicious_breaks=suspicious_breaks, stopped_early=stopped_early)
+  for line in report.lines():
+    print(line)
+  return report
+
+
+# Compiled core list shared by every file (or chunk, in a parallel run) a worker process handles
+_batch_core_list = None
 
-  count_diff = len(set(sectionDict.values())) - len(named_set)
-  if (count_diff > 0):
-    print(f'\nWARNING: Not all cores in {core_list_filename} were used.')
-    print(f"The following {str(count_diff)} core {'names were' if count_diff != 1 else 'name was'} not used:")
-    for v in sorted(list(set(sectionDict.values()))):
-      if (v not in named_set):
-        print(f'\t{v}')
-    print()
+def _init_batch_worker(sectionDict):
+  global _batch_core_list
+  _batch_core_list = CoreList(sectionDict)
 
 
-  print(f'{len(matched_data)} rows had section names assigned ({matched_filename}).')
-  print('There were no unmatched rows.' if len(unmatched_data) == 0 else f'There were {str(len(unmatched_data))} unmatched rows ({unmatched_filename}).')
+def _batch_worker(input_file, core_list_filename, kwargs):
+  # Run apply_names on one file, capturing its output so the batch report
+  # isn't interleaved with other workers.
+  log = io.StringIO()
+  report = None
+  with contextlib.redirect_stdout(log):
+    try:
+      report = apply_names(input_file, core_list_filename, section_dict=_batch_core_list, **kwargs)
+    except Exception as err:
+      print(f'ERROR: {err}')
+  return report, log.getvalue()
+
+
+def apply_names_batch(input_files, core_list_filename, jobs=None, **kwargs):
+  # Apply names to many files that share one core list. The core list is parsed
+  # once and handed to each worker process; file naming follows apply_names.
+  # Every file is processed and reported; if any failed, an AssignerError is
+  # raised at the end.
+  verbose = kwargs['verbose'] if 'verbose' in kwargs else False
+
+  if verbose:
+    start_time = timeit.default_timer()
+
+  use_cache = kwargs['use_cache'] if 'use_cache' in kwargs else True
+  sectionDict = read_core_list(core_list_filename, use_cache=use_cache, verbose=verbose)
+
+  with ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker, initargs=(sectionDict,)) as executor:
+    futures = [executor.submit(_batch_worker, input_file, core_list_filename, kwargs) for input_file in input_files]
+    results = [future.result() for future in futures]
+
+  ### Reporting stuff
+  reports = []
+  failed_files = []
+  for input_file, (report, log) in zip(input_files, results):
+    if verbose:
+      print(f'--- {input_file} ---\n{log}')
+    if report is None:
+      failed_files.append((input_file, log.strip()))
+    else:
+      reports.append(report)
+
+  if reports:
+    for core_name, core_name_count in reports[0].duplicate_cores.items():
+      print(f'WARNING: Core {core_name} appears in {core_list_filename} {str(core_name_count)} times.')
+
+  print(f'Processed {len(input_files)} files with core list {core_list_filename}:')
+  for report in reports:
+    print(f"  {report.input_file}: {report.matched_count} matched rows ({report.matched_filename}), {report.unmatched_count} unmatched rows{' (' + report.unmatched_filename + ')' if report.unmatched_filename else ''}.")
+    if report.unused_cores:
+      print(f"    {len(report.unused_cores)} unused {'cores' if len(report.unused_cores) != 1 else 'core'}: {', '.join(report.unused_cores)}")
+  for input_file, log in failed_files:
+    print(f'  {input_file}: FAILED\n    {log}')
+
+  print(f"Total: {sum(s.matched_count for s in reports)} matched rows, {sum(s.unmatched_count for s in reports)} unmatched rows.")
   if verbose:
     end_time = timeit.default_timer()
     print(f'Completed in {round((end_time - start_time),2)} seconds.')
 
+  if failed_files:
+    raise AssignerError(f"{len(failed_files)} of {len(input_files)} files failed: {', '.join(input_file for input_file, _ in failed_files)}.")
+  return reports
+
+
+def _is_output_file(filename):
+  name = split_compression_extension(filename)[0]
+  return name.endswith('_coreID.csv') or name.endswith('_unmatched.csv')
+
+
+def _read_run_log(run_log):
+  # Inputs already processed according to a run log, filename -> (size, mtime),
+  # and the set of output files those runs wrote
+  processed = {}
+  outputs = set()
+  try:
+    with open(run_log, 'r', encoding='utf-8') as f:
+      for line in f:
+        try:
+          entry = json.loads(line)
+        except ValueError:
+          continue
+        if entry.get('status') == 'ok':
+          processed[entry['input_file']] = (entry['input_size'], entry['input_mtime'])
+          outputs.update(os.path.abspath(entry[key]) for key in ['matched_filename', 'unmatched_filename'] if entry.get(key))
+  except OSError:
+    pass
+  return processed, outputs
+
+
+def _append_run_log(run_log, entry):
+  with open(run_log, 'a', encoding='utf-8') as f:
+    f.write(json.dumps(entry) + '\n')
+
+
+def watch_folders(directories, core_list_filename, jobs=None, patterns=None, interval=WATCH_INTERVAL, settle=WATCH_SETTLE, run_log=None, stop=None, **kwargs):
+  # Keep watching directories for MSCL exports and run apply_names on each one
+  # once it has stopped changing for settle seconds. Files are handed to a pool
+  # of worker processes that already hold the parsed core list; the pool is
+  # restarted with the new core list if the core list file changes. Each run is
+  # appended as a JSON line to run_log (default: coreid_runs.jsonl in the file's
+  # directory). Files the log says were processed at their current size and
+  # modification time are skipped, so restarting the watch doesn't redo them.
+  # Outputs of earlier runs are never picked up as inputs, including those of
+  # _unnamed exports, which are written under a name the patterns match.
+  # Runs until interrupted, or until stop (a threading.Event) is set.
+  verbose = kwargs['verbose'] if 'verbose' in kwargs else False
+  use_cache = kwargs['use_cache'] if 'use_cache' in kwargs else True
+  patterns = patterns or WATCH_PATTERNS
+
+  def log_filename(input_file):
+    return run_log or os.path.join(os.path.dirname(input_file), RUN_LOG_NAME)
+
+  processed = {}
+  outputs = set()
+  for log in set(run_log and [run_log] or [os.path.join(d, RUN_LOG_NAME) for d in directories]):
+    log_processed, log_outputs = _read_run_log(log)
+    processed.update(log_processed)
+    outputs.update(log_outputs)
+
+  core_list_stat = None
+  executor = None
+  seen = {}      # filename -> (size, mtime, time first seen at that size and mtime)
+  running = {}   # future -> (filename, size, mtime, start time)
+
+  def finish(future):
+    input_file, size, mtime, start = running.pop(future)
+    report, log = future.result()
+    # A failed file is not retried until it changes
+    processed[input_file] = (size, mtime)
+    entry = {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+             'status': 'ok' if report is not None else 'failed',
+             'input_file': input_file,
+             'input_size': size,
+             'input_mtime': mtime,
+             'seconds': time.time() - start}
+    if report is not None:
+      entry.update(report.to_dict())
+      outputs.update(os.path.abspath(filename) for filename in [report.matched_filename, report.unmatched_filename] if filename)
+      print(f"{input_file}: {report.matched_count} matched rows ({report.matched_filename}), {report.unmatched_count} unmatched rows{' (' + report.unmatched_filename + ')' if report.unmatched_filename else ''}.")
+    else:
+      print(f'{input_file}: FAILED\n    {log.strip()}')
+    entry['log'] = log
+    _append_run_log(log_filename(input_file), entry)
+
+  print(f"Watching {', '.join(directories)} for {', '.join(patterns)} (core list {core_list_filename}). Press Ctrl+C to stop.")
+  try:
+    while stop is None or not stop.is_set():
+      # (Re)start the workers whenever the core list changes
+      try:
+        stat = os.stat(core_list_filename)
+        if (stat.st_size, stat.st_mtime) != core_list_stat:
+          sectionDict = read_core_list(core_list_filename, use_cache=use_cache, verbose=verbose)
+          if executor is not None:
+            executor.shutdown(wait=False)
+            print(f'Core list {core_list_filename} changed, restarting workers.')
+          executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_batch_worker, initargs=(sectionDict,))
+          core_list_stat = (stat.st_size, stat.st_mtime)
+      except (OSError, AssignerError) as err:
+        if executor is None:
+          raise CoreListError(f'Could not read core list {core_list_filename}: {err}') from err
+
+      now = time.time()
+      in_progress = {filename for filename, *_ in running.values()}
+      for directory in directories:
+        try:
+          names = os.listdir(directory)
+        except OSError:
+          continue
+        # An _unnamed export's output is named without '_unnamed'; skip it
+        # even while that run is still writing it
+        unnamed_outputs = {name.replace('_unnamed', '') for name in names if '_unnamed' in name}
+        for name in names:
+          input_file = os.path.join(directory, name)
+          if not any(fnmatch.fnmatch(name, pattern) for pattern in patterns) or _is_output_file(name):
+            continue
+          if name in unnamed_outputs or os.path.abspath(input_file) in outputs:
+            continue
+          try:
+            stat = os.stat(input_file)
+          except OSError:
+            continue
+          state = (stat.st_size, stat.st_mtime)
+          if input_file in in_progress or processed.get(input_file) == state:
+            continue
+          if input_file not in seen or seen[input_file][:2] != state:
+            seen[input_file] = state + (now,)
+          elif now - seen[input_file][2] >= settle:
+            del seen[input_file]
+            if verbose:
+              print(f'Processing {input_file}')
+            future = executor.submit(_batch_worker, input_file, core_list_filename, kwargs)
+            running[future] = (input_file, stat.st_size, stat.st_mtime, now)
+
+      for future in [future for future in running if future.done()]:
+        finish(future)
+
+      if stop is not None:
+        stop.wait(interval)
+      else:
+        time.sleep(interval)
+
+    # Let files already handed to the workers finish before stopping
+    for future in list(running):
+      finish(future)
+  except KeyboardInterrupt:
+    print('Stopping.')
+  finally:
+    if executor is not None:
+      # Drop files still waiting for a worker by hand, as shutdown() can only do it from Python 3.9
+      for future in running:
+        future.cancel()
+      executor.shutdown(wait=True)
+
 
 def main():
   parser = argparse.ArgumentParser(description='Apply CoreIDs to the output from Geotek MSCL software.')
-  parser.add_argument('input_file', type=str, help='Name of input file.')
+  parser.add_argument('input_file', type=str, nargs='+', help='Name of input file. Several files or a glob (e.g. "*_MSCL.csv") can be given to run in batch mode. With --watch, the directories to watch.')
   parser.add_argument('corelist', type=str, help='Name of the core list file.')
   parser.add_argument('-o', '--output_filename', type=str, help='Name of the output file.')
   parser.add_argument('-v', '--verbose', action='store_true', help='Increase verbosity.')
   parser.add_argument('-s', '--section_column', type=int, help='Column number the section numbers are in (count starts at 0).')
   parser.add_argument('-d', '--depth_column', type=int, help='Column number the section depths are in (count starts at 0).')
+  parser.add_argument('--header_row', type=int, help='Row the column names are in (count starts at 0, default 0).')
+  parser.add_argument('--units_row', type=int, help='Row the units are in (count starts at 0, default 1).')
+  parser.add_argument('--start_row', type=int, help='First row of data (count starts at 0, default 2).')
+  parser.add_argument('-e', '--engine', choices=ENGINES, default='python', help='Part_Section engine to use (numpy is fastest on large files: it matches and writes whole blocks of rows at once; mmap copies all but the section column straight through).')
+  parser.add_argument('-z', '--compress', dest='compression', choices=COMPRESSIONS + ['none'], help='Compress the outputs (default: the same compression as the input, or as --output_filename\'s extension). Compressed inputs and core lists (.gz, .bz2, .xz) are always read directly.')
+  parser.add_argument('--compress-level', type=int, help='Compression level, 0-9 (1-9 for bz2; default 6, or 9 for bz2).')
+  parser.add_argument('-f', '--format', dest='output_format', choices=OUTPUT_FORMATS, default='csv', help='Write the matched rows as CSV, as a typed columnar .col file (load it with columnar.load()), or both.')
+  parser.add_argument('--columnar-unmatched', action='store_true', help='Write the unmatched rows as a columnar .col file too (with --format columnar, instead of CSV).')
+  parser.add_argument('--sort-by', action='append', help='Sort the rows by this column (name or number; give it more than once for a key of several columns, e.g. a session column, then SECT NUM, then SECT DEPTH) before assigning parts, for merged or out of order exports. Files larger than memory are sorted in runs spilled to temporary files.')
+  parser.add_argument('--sort-memory', dest='sort_run_rows', type=int, help=f'Rows to sort in memory at a time with --sort-by (default: {SORT_RUN_ROWS}).')
+  parser.add_argument('--sort-temp-dir', type=str, help='Directory for the temporary files of --sort-by (default: the system temporary directory).')
+  parser.add_argument('-p', '--pipeline', action='store_true', help='Write the outputs on background threads with large buffers, so writing overlaps with reading and matching (helps on slow disks and network shares).')
+  parser.add_argument('-j', '--jobs', type=int, help='Number of worker processes. In batch mode files are spread over them (default: number of CPUs); with one uncompressed input file it is split into chunks that are matched in parallel (default: 1).')
+  parser.add_argument('--no-cache', dest='use_cache', action='store_false', help='Always parse the core list instead of using the compiled core list cache.')
+  parser.add_argument('-i', '--incremental', action='store_true', help='Only process rows added since the last incremental run and append them to its outputs. Progress is kept in a .checkpoint.json file next to the output; a last row without a line ending is written but processed again on the next run.')
+  parser.add_argument('-w', '--watch', action='store_true', help='Keep watching the input directories and process each MSCL export once it stops changing. Runs are logged to coreid_runs.jsonl in each directory. Stop with Ctrl+C.')
+  parser.add_argument('--pattern', dest='patterns', action='append', help=f"File name pattern of the exports to process in watch mode; can be given more than once (default: {', '.join(WATCH_PATTERNS)}).")
+  parser.add_argument('--interval', type=float, default=WATCH_INTERVAL, help=f'Seconds between checks of the watched directories (default: {WATCH_INTERVAL:g}).')
+  parser.add_argument('--settle', type=float, default=WATCH_SETTLE, help=f'Seconds a file must stay unchanged before it is processed in watch mode (default: {WATCH_SETTLE:g}).')
+  parser.add_argument('--run-log', type=str, help='Log every watch mode run to this file instead of coreid_runs.jsonl in each watched directory.')
+  parser.add_argument('--check', action='store_true', help='Only check the input against the core list: report unmatched rows, unused and duplicate cores and suspicious part breaks without writing any files. Exits with status 1 if problems are found.')
+  parser.add_argument('--max-unmatched', type=int, help='With --check, stop as soon as more than this many rows are unmatched.')
+  parser.add_argument('--profile-report', type=str, help='Write a JSON report of the time spent in each phase, row and byte counts and peak memory to this file.')
+  parser.add_argument('--cprofile', type=str, help='Write cProfile stats for the run to this file (view with python -m pstats).')
 
   args = parser.parse_args()
 
-  apply_names(args.input_file,
-              args.corelist,
-              section_column=args.section_column,
-              depth_column=args.depth_column,
-              output_filename=args.output_filename,
-              verbose=args.verbose)
+  # Problems with the settings, core list or input are printed, not raised
+  try:
+    if args.watch:
+      if args.output_filename or args.profile_report or args.cprofile or args.check:
+        parser.error('--output_filename, --profile-report, --cprofile and --check cannot be used with --watch.')
+      for directory in args.input_file:
+        if not os.path.isdir(directory):
+          parser.error(f'{directory} is not a directory.')
+      watch_folders(args.input_file,
+                    args.corelist,
+                    jobs=args.jobs,
+                    patterns=args.patterns,
+                    interval=args.interval,
+                    settle=args.settle,
+                    run_log=args.run_log,
+                    section_column=args.section_column,
+                    depth_column=args.depth_column,
+                    header_row=args.header_row,
+                    units_row=args.units_row,
+                    start_row=args.start_row,
+                    engine=args.engine,
+                    compression=args.compression,
+                    compress_level=args.compress_level,
+                    output_format=args.output_format,
+                    columnar_unmatched=args.columnar_unmatched,
+                    pipeline=args.pipeline,
+                    sort_by=args.sort_by,
+                    sort_run_rows=args.sort_run_rows,
+                    sort_temp_dir=args.sort_temp_dir,
+                    use_cache=args.use_cache,
+                    incremental=args.incremental,
+                    verbose=args.verbose)
+      return
+
+    # Expand globs here so they also work in shells that don't (e.g. cmd.exe)
+    input_files = []
+    for input_file in args.input_file:
+      input_files.extend(sorted(glob.glob(input_file)) if glob.has_magic(input_file) else [input_file])
+    if not input_files:
+      parser.error(f"No input files match {', '.join(args.input_file)}.")
+
+    if args.check:
+      # check_export reads the rows in file order, so a check of sorted rows would
+      # report part breaks the real run wouldn't see
+      if args.sort_by:
+        parser.error('--check cannot be used with --sort-by.')
+      sectionDict = read_core_list(args.corelist, use_cache=args.use_cache, verbose=args.verbose)
+      reports = [check_export(input_file,
+                              args.corelist,
+                              max_unmatched=args.max_unmatched,
+                              section_dict=sectionDict,
+                              section_column=args.section_column,
+                              depth_column=args.depth_column,
+                              header_row=args.header_row,
+                              units_row=args.units_row,
+                              start_row=args.start_row,
+                              verbose=args.verbose) for input_file in input_files]
+      if not all(report.ok for report in reports):
+        exit(1)
+      return
+
+    if len(input_files) > 1:
+      if args.output_filename or args.profile_report or args.cprofile:
+        parser.error('--output_filename, --profile-report and --cprofile cannot be used with more than one input file.')
+      apply_names_batch(input_files,
+                        args.corelist,
+                        jobs=args.jobs,
+                        section_column=args.section_column,
+                        depth_column=args.depth_column,
+                        header_row=args.header_row,
+                        units_row=args.units_row,
+                        start_row=args.start_row,
+                        engine=args.engine,
+                        compression=args.compression,
+                        compress_level=args.compress_level,
+                        output_format=args.output_format,
+                        columnar_unmatched=args.columnar_unmatched,
+                        pipeline=args.pipeline,
+                        sort_by=args.sort_by,
+                        sort_run_rows=args.sort_run_rows,
+                        sort_temp_dir=args.sort_temp_dir,
+                        use_cache=args.use_cache,
+                        incremental=args.incremental,
+                        verbose=args.verbose)
+      return
+
+    apply_names(input_files[0],
+                args.corelist,
+                section_column=args.section_column,
+                depth_column=args.depth_column,
+                header_row=args.header_row,
+                units_row=args.units_row,
+                start_row=args.start_row,
+                output_filename=args.output_filename,
+                engine=args.engine,
+                compression=args.compression,
+                compress_level=args.compress_level,
+                output_format=args.output_format,
+                columnar_unmatched=args.columnar_unmatched,
+                jobs=args.jobs,
+                pipeline=args.pipeline,
+                sort_by=args.sort_by,
+                sort_run_rows=args.sort_run_rows,
+                sort_temp_dir=args.sort_temp_dir,
+                use_cache=args.use_cache,
+                incremental=args.incremental,
+                profile_report=args.profile_report,
+                cprofile=args.cprofile,
+                verbose=args.verbose)
+  except AssignerError as err:
+    print(f'ERROR: {err}')
+    exit(1)
 
 if __name__ == '__main__':
   main()